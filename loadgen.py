@@ -0,0 +1,223 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import argparse
+import logging
+import os
+import Queue
+import threading
+import time
+from collections import deque
+
+from modules.chat import twitch, goodgame, sc2tv
+from modules.helper.system import LOG_FORMAT, THREADS, BATCH_SIZE, BATCH_TIMEOUT
+from modules.helper.testing import LoadMix, generate_load, EVENT_SUB, EVENT_CLEAR
+from replay import load_pipeline, close_pipeline, report
+
+log = logging.getLogger('loadgen')
+OFFLINE_SOCKET = 'ws://localhost/'
+EMOTE_URL = 'http://localhost/emote.png'
+CHAT_CONFIG = {'config': {'config': {'show_pm': True,
+                                     'show_channel_names': True,
+                                     'show_nickname_colors': True}}}
+
+
+class OfflineChatModule(object):
+    """
+        Stands in for chat module, connectors only read settings
+        and report channel status to it
+    """
+    def conf_params(self):
+        return CHAT_CONFIG
+
+    def set_online(self, *args):
+        pass
+
+    def set_offline(self, *args):
+        pass
+
+    def set_viewers(self, *args):
+        pass
+
+    def get_viewers(self, *args):
+        pass
+
+
+class OfflineChannel(object):
+    """
+        Stands in for connection thread of channel
+    """
+    def __init__(self, nick, chat_module):
+        self.nick = nick
+        self.display_name = nick
+        self.chat_module = chat_module
+
+
+class TwitchFeed(object):
+    emotes = [(u'Kappa', u'25'), (u'PogChamp', u'88'), (u'Kreygasm', u'41'), (u'4Head', u'354')]
+
+    def __init__(self, queue, channel, chat_module):
+        self.irc = twitch.IRC(queue, channel, main_class=OfflineChannel(channel, chat_module),
+                              chat_module=chat_module, settings={}, bttv_smiles_dict={},
+                              badges={}, custom_badges={})
+        self.handler_queue = self.irc.twitch_queue
+
+    def put(self, event):
+        if event.kind == EVENT_CLEAR:
+            msg = twitch.TwitchMessage(event.user, u'')
+            msg.type = 'clearchat'
+            msg.arguments = [event.user]
+            self.handler_queue.put(msg)
+            return
+
+        words = list(event.words)
+        positions = {}
+        for index in event.emotes:
+            words[index], emote_id = self.emotes[index % len(self.emotes)]
+            positions.setdefault(emote_id, []).append(index)
+
+        offsets = []
+        offset = 0
+        for word in words:
+            offsets.append(offset)
+            offset += len(word) + 1
+        emotes_tag = []
+        for emote_id, indexes in positions.iteritems():
+            emote_positions = [u'{0}-{1}'.format(offsets[index], offsets[index] + len(words[index]) - 1)
+                               for index in indexes]
+            emotes_tag.append(u'{0}:{1}'.format(emote_id, u','.join(emote_positions)))
+
+        bits = u''
+        if event.bits:
+            bits = unicode(event.bits)
+            words.append(u'cheer{0}'.format(bits))
+
+        msg = twitch.TwitchMessage(event.user, u' '.join(words), u'/'.join(emotes_tag), bits)
+        if event.kind == EVENT_SUB:
+            msg.type = 'usernotice'
+            msg.tags.append({'key': u'system-msg', 'value': u'{0} just subscribed!'.format(event.user)})
+        self.handler_queue.put(msg)
+
+
+class GoodgameFeed(object):
+    emotes = [u'peka', u'roflan', u'lol', u'fp']
+
+    def __init__(self, queue, channel, chat_module):
+        smiles = dict((name, {'channel_id': '0', 'is_premium': False, 'donate_lvl': 0,
+                              'urls': {'big': EMOTE_URL, 'gif': ''}}) for name in self.emotes)
+        self.ws = goodgame.GGChat(OFFLINE_SOCKET, queue=queue, nick=channel,
+                                  main_thread=OfflineChannel(channel, chat_module),
+                                  chat_module=chat_module, settings={}, smiles=smiles)
+        self.handler_queue = self.ws.gg_queue
+        self.message_ids = deque(maxlen=100)
+
+    def put(self, event):
+        # Goodgame removes messages by id instead of clearing user chat
+        if event.kind == EVENT_CLEAR:
+            message_id = self.message_ids.pop() if self.message_ids else '0'
+            self.handler_queue.put({'type': 'remove_message', 'data': {'message_id': message_id}})
+            return
+
+        words = list(event.words)
+        for index in event.emotes:
+            words[index] = goodgame.SMILE_FORMAT.format(self.emotes[index % len(self.emotes)])
+        msg = goodgame.gg_message(event.user, u' '.join(words))
+        msg['data'].update({'user_rights': 0, 'payments': 0, 'premiums': [], 'premium': 0})
+        self.message_ids.append(msg['data']['message_id'])
+        self.handler_queue.put(msg)
+
+
+class Sc2tvFeed(object):
+    emotes = [u'peka', u'kappa', u'fail', u'gg']
+
+    def __init__(self, queue, channel, chat_module):
+        smiles = [{'code': name, 'url': EMOTE_URL, 'user': None} for name in self.emotes]
+        self.ws = sc2tv.FsChat(OFFLINE_SOCKET, queue, channel, protocols=['websocket'], smiles=smiles,
+                               main_thread=OfflineChannel(channel, chat_module),
+                               chat_module=chat_module, channel_id=1)
+        # Funstream messages are processed by websocket thread, so it is emulated with queue
+        self.handler_queue = Queue.Queue()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        while True:
+            self.ws.received_message(self.handler_queue.get())
+            self.handler_queue.task_done()
+
+    def put(self, event):
+        # Funstream doesn't have sub notices and clearchat, sending them as messages
+        words = list(event.words) or [event.user]
+        for index in event.emotes:
+            words[index] = sc2tv.SMILE_FORMAT.format(self.emotes[index % len(self.emotes)])
+        self.handler_queue.put(sc2tv.Sc2tvMessage(event.user, u' '.join(words)))
+
+
+FEEDS = {twitch.SOURCE: TwitchFeed,
+         goodgame.SOURCE: GoodgameFeed,
+         sc2tv.SOURCE: Sc2tvFeed}
+
+
+def build_feeds(queue, sources, channels):
+    """
+        Creates connector message handlers without network connection
+    :return: dict of (source, channel) to feed
+    """
+    chat_module = OfflineChatModule()
+    feeds = {}
+    for source in sources:
+        for index in range(channels):
+            channel = 'load_{0}_{1}'.format(source, index)
+            feeds[(source, channel)] = FEEDS[source](queue, channel, chat_module)
+    return feeds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates synthetic chat load through connectors '
+                                                 'and messaging modules without network')
+    parser.add_argument('--rate', type=float, default=1000, help='events per second, 0 is as fast as possible')
+    parser.add_argument('--count', type=int, help='amount of events to generate')
+    parser.add_argument('--duration', type=float, help='seconds to generate events for')
+    parser.add_argument('--sources', default=','.join(sorted(FEEDS)), help='comma separated list of sources')
+    parser.add_argument('--channels', type=int, default=1, help='channels per source')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--emote-density', type=float, default=0.2, help='share of words that are emotes')
+    parser.add_argument('--bits', type=float, default=0.01, help='share of messages with bits')
+    parser.add_argument('--subs', type=float, default=0.01, help='share of sub notices')
+    parser.add_argument('--clearchat', type=float, default=0.005, help='share of clearchat events')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, default=THREADS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--batch-timeout', type=int, default=BATCH_TIMEOUT, help='milliseconds')
+    args = parser.parse_args()
+    if args.count is None and args.duration is None:
+        args.duration = 10
+
+    queue, msg, loaded_modules = load_pipeline(args.workers, args.batch_size, args.batch_timeout)
+    msg.start()
+
+    feeds = build_feeds(queue, args.sources.split(','), args.channels)
+    mix = LoadMix(feeds.keys(), emote_density=args.emote_density, bits=args.bits, subs=args.subs,
+                  clearchat=args.clearchat, users=args.users, seed=args.seed)
+
+    log.info("Generating load for %s channels", len(feeds))
+    start_time = time.time()
+    count = generate_load(mix, lambda event: feeds[event.channel].put(event), args.rate,
+                          count=args.count, duration=args.duration)
+    for feed in feeds.values():
+        feed.handler_queue.join()
+    msg.wait_processed()
+    elapsed = time.time() - start_time
+
+    print report(count, elapsed, msg)
+    close_pipeline(loaded_modules)
+    # Message handlers are not daemon threads
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(LOG_FORMAT)
+    root_logger.addHandler(console_handler)
+    main()
@@ -3,16 +3,17 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
 import os
 import imp
-import Queue
 from time import sleep
 import messaging
+from modules.helper.replay import MessageRecorder
 import logging
 import logging.config
 import semantic_version
 from collections import OrderedDict
 from modules.helper.parser import load_from_config_file
 from modules.helper.system import load_translations_keys, PYTHON_FOLDER, CONF_FOLDER, MAIN_CONF_FILE, MODULE_FOLDER, \
-    LOG_FOLDER, GUI_TAG, TRANSLATION_FOLDER, LOG_FILE, LOG_FORMAT, get_language, get_update, ModuleLoadException
+    LOG_FOLDER, GUI_TAG, TRANSLATION_FOLDER, LOG_FILE, LOG_FORMAT, THREADS, BATCH_SIZE, BATCH_TIMEOUT, get_language, \
+    get_update, ModuleLoadException, STATS_INTERVAL, QUEUE_SIZE, QUEUE_POLICY, RECORD_FILE
 from modules.helper.module import BaseModule
 
 VERSION = '0.3.6'
@@ -21,6 +22,8 @@ SEM_VERSION = semantic_version.Version(VERSION)
 
 def init():
     def close():
+        if queue.recorder:
+            queue.recorder.close()
         for l_module, l_module_dict in loaded_modules.iteritems():
             l_module_dict['class'].apply_settings(system_exit=True)
 
@@ -67,6 +70,13 @@ def init():
     main_config_dict['system'] = OrderedDict()
     main_config_dict['system']['log_level'] = 'INFO'
     main_config_dict['system']['testing_mode'] = False
+    main_config_dict['system']['workers'] = THREADS
+    main_config_dict['system']['batch_size'] = BATCH_SIZE
+    main_config_dict['system']['batch_timeout'] = BATCH_TIMEOUT
+    main_config_dict['system']['stats_interval'] = STATS_INTERVAL
+    main_config_dict['system']['queue_size'] = QUEUE_SIZE
+    main_config_dict['system']['queue_policy'] = QUEUE_POLICY
+    main_config_dict['system']['record_file'] = RECORD_FILE
     main_config_dict['gui'] = OrderedDict()
     main_config_dict['gui']['cli'] = False
     main_config_dict['gui']['show_icons'] = False
@@ -87,7 +97,9 @@ def init():
             'check': 'translations'
         },
         'system': {
-            'hidden': ['log_level', 'testing_mode'],
+            'hidden': ['log_level', 'testing_mode', 'workers', 'batch_size', 'batch_timeout',
+                       'stats_interval', 'queue_size', 'queue_policy',
+                       'record_file'],
         },
         'gui': {
             'hidden': ['cli']
@@ -137,7 +149,10 @@ def init():
         log.exception("Failed loading translations")
 
     # Creating queues for messaging transfer between chat threads
-    queue = Queue.Queue()
+    queue = messaging.MessageQueue(maxsize=main_config_dict['system']['queue_size'],
+                                   policy=main_config_dict['system']['queue_policy'])
+    if main_config_dict['system']['record_file']:
+        queue.recorder = MessageRecorder(main_config_dict['system']['record_file'])
     # Loading module for message processing...
     msg = messaging.Message(queue)
     loaded_modules.update(msg.load_modules(main_config, loaded_modules['main']))
@@ -196,7 +211,7 @@ def init():
                                               queue=queue)
                 log.debug('loaded module {}'.format(f_module))
             except ModuleLoadException:
-                msg.modules.remove(loaded_modules[f_module]['class'])
+                msg.remove_module(loaded_modules[f_module]['class'])
                 loaded_modules.pop(f_module)
     log.info('LalkaChat loaded successfully')
 
@@ -215,9 +230,18 @@ def init():
             while True:
                 console = raw_input("> ")
                 log.info(console)
+                command = console.split()
+                module_class = loaded_modules.get(command[0], {}).get('class') if command else None
+                cli_commands = module_class.cli_commands() if hasattr(module_class, 'cli_commands') else {}
                 if console == "exit":
                     log.info("Exiting now!")
                     close()
+                elif len(command) > 1 and command[1] in cli_commands:
+                    # Module commands: > %module_name% $command args
+                    try:
+                        log.info(cli_commands[command[1]](command[2:]))
+                    except Exception as exc:
+                        log.exception(exc)
                 else:
                     log.info("Incorrect Command")
         except (KeyboardInterrupt, SystemExit):
@@ -4,28 +4,233 @@
 import os
 import threading
 import imp
+import itertools
+import json
 import operator
 import logging
-from collections import OrderedDict
+import time
+import Queue
+from collections import OrderedDict, deque
 
 from modules.helper.module import BaseModule
-from modules.helper.system import ModuleLoadException, THREADS, CONF_FOLDER
+from modules.helper.stats import ModuleStats
+from modules.helper.system import ModuleLoadException, THREADS, CONF_FOLDER, BATCH_SIZE, BATCH_TIMEOUT, \
+    STATS_INTERVAL, IGNORED_TYPES, MESSAGE_TYPES, MODULE_KEY, system_message, translate_key
 from modules.helper.parser import load_from_config_file
+from modules.helper.text import TextEditor, apply_edits
 
 
 log = logging.getLogger('messaging')
 MODULE_PRI_DEFAULT = '100'
+SHARD_QUEUE_SIZE = 1000
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_DROP_NEW = 'drop_new'
+QUEUE_POLICIES = [POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEW]
+# Commands and system messages are never dropped or blocked
+PROTECTED_TYPES = IGNORED_TYPES
+# Commands and system messages skip ahead of queued chat messages
+PRIORITY_TYPES = IGNORED_TYPES
+DROP_MESSAGE_DELAY = 10
+
+
+def command_targets(command, message):
+    if command.get('command') in ['remove_by_user', 'replace_by_user']:
+        return message.get('user') in command.get('user', [])
+    elif command.get('command') in ['remove_by_id', 'replace_by_id']:
+        return message.get('id') in command.get('ids', [])
+    return False
+
+
+def shard_key(message):
+    # Messages from the same channel should always be processed by the
+    #  same handler, so they are not reordered
+    return message.get('source'), message.get('channel')
+
+
+class MessageQueue(Queue.Queue):
+    """
+        Main queue for messages from chats.
+        When queue holds maxsize messages it either blocks the producer
+        or drops chat messages, depending on policy.
+        Commands and system messages are put in priority lane and are
+        returned before any queued chat message, each lane is FIFO.
+        Only queue with defer_commands repeats commands after chat messages they
+        skipped, repeated command is marked deferred until it is put in next queue.
+    """
+    def __init__(self, maxsize=0, policy=POLICY_BLOCK, defer_commands=True):
+        Queue.Queue.__init__(self)
+        self.defer_commands = defer_commands
+        if policy not in QUEUE_POLICIES:
+            log.warning("Unknown queue policy %s, using %s", policy, POLICY_BLOCK)
+            policy = POLICY_BLOCK
+        self.limit = max(int(maxsize), 0)
+        self.policy = policy
+        self.dropped = 0
+        self.recorder = None
+        self._drop_counter = 0
+        self._drop_message_time = 0
+        self._drop_timer = None
+
+    def _init(self, maxsize):
+        Queue.Queue._init(self, maxsize)
+        self.priority_queue = deque()
+
+    def _qsize(self, len=len):
+        return len(self.queue) + len(self.priority_queue)
+
+    def _put(self, item):
+        # Deferred command keeps its place after chat messages in the next queue too
+        if item.get('type') not in PRIORITY_TYPES or item.pop('deferred', False):
+            self.queue.append(item)
+            return
+
+        self.priority_queue.append(item)
+        if self.defer_commands and item.get('type') == 'command' and \
+                any(command_targets(item, message) for message in self.queue):
+            # Command skipped ahead of chat messages it should be applied to,
+            #  so it's repeated after them to keep the result the same as in FIFO order
+            deferred = dict(item)
+            deferred['deferred'] = True
+            self.queue.append(deferred)
+            self.unfinished_tasks += 1
+
+    def _get(self):
+        if self.priority_queue:
+            return self.priority_queue.popleft()
+        return self.queue.popleft()
+
+    def full(self):
+        with self.mutex:
+            return 0 < self.limit <= self._qsize()
+
+    def put(self, item, block=True, timeout=None):
+        if self.recorder:
+            self.recorder.record(item)
+        dropped = None
+        with self.not_full:
+            if self.limit and item.get('type') not in PROTECTED_TYPES:
+                if self.policy == POLICY_BLOCK:
+                    self._wait_not_full(block, timeout)
+                elif self._qsize() >= self.limit:
+                    if self.policy == POLICY_DROP_OLDEST:
+                        dropped = self._pop_oldest()
+                    if dropped is None:
+                        dropped = item
+
+            if dropped is not item:
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+            if dropped is not None:
+                self.dropped += 1
+                self._drop_counter += 1
+            drop_count = self._get_drop_count()
+
+        if drop_count:
+            self._notify_dropped(drop_count)
+
+    def _notify_dropped(self, drop_count):
+        system_message(translate_key(MODULE_KEY.join(['main', 'queue_dropped'])).format(drop_count), self)
+
+    def _flush_drop_count(self):
+        with self.mutex:
+            self._drop_timer = None
+            drop_count = self._get_drop_count()
+        if drop_count:
+            self._notify_dropped(drop_count)
+
+    def _wait_not_full(self, block, timeout):
+        if not block:
+            if self._qsize() >= self.limit:
+                raise Queue.Full
+        elif timeout is None:
+            while self._qsize() >= self.limit:
+                self.not_full.wait()
+        else:
+            end_time = time.time() + timeout
+            while self._qsize() >= self.limit:
+                remaining = end_time - time.time()
+                if remaining <= 0.0:
+                    raise Queue.Full
+                self.not_full.wait(remaining)
+
+    def _pop_oldest(self):
+        for index, queue_item in enumerate(self.queue):
+            if queue_item.get('type') not in PROTECTED_TYPES:
+                del self.queue[index]
+                self.unfinished_tasks -= 1
+                return queue_item
+        return None
+
+    def _get_drop_count(self):
+        # Notifying about dropped messages at most once in DROP_MESSAGE_DELAY seconds,
+        #  drops that are not reported yet are reported by timer when delay passes
+        if not self._drop_counter:
+            return 0
+        remaining = self._drop_message_time + DROP_MESSAGE_DELAY - time.time()
+        if remaining > 0:
+            if self._drop_timer is None:
+                self._drop_timer = threading.Timer(remaining, self._flush_drop_count)
+                self._drop_timer.daemon = True
+                self._drop_timer.start()
+            return 0
+        drop_count = self._drop_counter
+        self._drop_counter = 0
+        self._drop_message_time = time.time()
+        return drop_count
 
 
 class MessageHandler(threading.Thread):
-    def __init__(self, queue, process):
+    def __init__(self, queue, process, batch_size=BATCH_SIZE, batch_timeout=BATCH_TIMEOUT):
         self.queue = queue
         self.process = process
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_timeout = max(float(batch_timeout), 0) / 1000
         threading.Thread.__init__(self)
 
+    def get_batch(self):
+        # Blocking until first message arrives, then draining the queue
+        #  until batch is full or batch timeout has passed
+        batch = [self.queue.get()]
+        deadline = time.time() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            try:
+                self.process(batch)
+            except Exception as exc:
+                log.exception("Failed to process messages: %s", exc)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+class StatsLogger(threading.Thread):
+    def __init__(self, stats, interval):
+        super(self.__class__, self).__init__()
+        self.daemon = True
+        self.stats = stats
+        self.interval = interval
+
     def run(self):
         while True:
-            self.process(self.queue.get())
+            time.sleep(self.interval)
+            log.info("Messaging modules statistics")
+            for module_stats in self.stats.values():
+                log.info("%s", module_stats)
 
 
 class Message(threading.Thread):
@@ -33,16 +238,29 @@ class Message(threading.Thread):
         super(self.__class__, self).__init__()
         # Creating dict for dynamic modules
         self.modules = []
+        self.chains = {}
+        self.default_chain = []
         self.daemon = True
         self.msg_counter = 0
         self.queue = queue
         self.module_tag = "modules.messaging"
         self.threads = []
+        self.workers = THREADS
+        self.batch_size = BATCH_SIZE
+        self.batch_timeout = BATCH_TIMEOUT
+        self.stats = OrderedDict()
+        self.stats_interval = STATS_INTERVAL
 
     def load_modules(self, main_config, settings):
         log.info("Loading configuration file for messaging")
         modules_list = OrderedDict()
 
+        system_config = settings.get('config', {}).get('system', {})
+        self.workers = max(int(system_config.get('workers', THREADS)), 1)
+        self.batch_size = system_config.get('batch_size', BATCH_SIZE)
+        self.batch_timeout = system_config.get('batch_timeout', BATCH_TIMEOUT)
+        self.stats_interval = int(system_config.get('stats_interval', STATS_INTERVAL))
+
         conf_file = os.path.join(main_config['conf_folder'], "messaging_modules.cfg")
         conf_dict = OrderedDict()
         conf_dict['gui_information'] = {'category': 'messaging'}
@@ -65,6 +283,8 @@ class Message(threading.Thread):
                 'gui': conf_gui},
             conf_file_name='messaging_modules.cfg'
         )
+        messaging_module.rest_add('GET', 'stats', self.rest_get_stats)
+        messaging_module.rest_add('DELETE', 'stats', self.rest_reset_stats)
 
         modules_list['messaging'] = messaging_module.conf_params()
 
@@ -105,25 +325,131 @@ class Message(threading.Thread):
         for sorted_priority, sorted_list in sorted_module:
             for sorted_list_item in sorted_list:
                 self.modules.append(sorted_list_item)
+                self.stats[sorted_list_item] = ModuleStats(sorted_list_item.__class__.__name__,
+                                                           batch=sorted_list_item.has_batch_hook())
+        self.build_chains()
 
         return modules_list
 
-    def msg_process(self, message):
+    def build_chains(self):
+        # Precomputing list of modules for every message type, so messages
+        #  are passed only to modules that process their type
+        self.default_chain = [m_module for m_module in self.modules if m_module.message_types() is None]
+        chains = {}
+        for message_type in MESSAGE_TYPES:
+            chains[message_type] = [m_module for m_module in self.modules
+                                    if m_module.message_types() is None or message_type in m_module.message_types()]
+        self.chains = chains
+
+    def remove_module(self, m_module):
+        self.modules.remove(m_module)
+        self.build_chains()
+
+    def prepare_message(self, message):
         if ('to' in message) and (message['to'] is not None):
-            message['text'] = ', '.join([message['to'], message['text']])
+            editor = TextEditor(message['text'])
+            editor.replace(0, 0, u'{0}, '.format(message['to']))
+            apply_edits(message, editor)
+        return message
+
+    def msg_process(self, message):
+        self.batch_process([message])
+
+    def batch_process(self, messages):
+        messages = [self.prepare_message(message) for message in messages]
+        # Consecutive messages of the same type are processed together,
+        #  so order of messages is kept
+        for message_type, group in itertools.groupby(messages, key=operator.itemgetter('type')):
+            self.chain_process(list(group), self.chains.get(message_type, self.default_chain))
 
+    def chain_process(self, messages, chain):
+        # When we receive messages we pass them via modules of the chain
+        # All modules should return the messages with modified/not modified
+        #  content so they can be passed to new module, or to pass to CLI
+        # Messages dropped by module are not passed further
+
+        for m_module in chain:
+            if not messages:
+                break
+            module_stats = self.stats[m_module]
+            timings = None if module_stats.batch else []
+            start_time = time.time()
+            try:
+                if timings is None:
+                    processed = m_module.process_batch(messages, self.queue)
+                else:
+                    processed = m_module.process_batch(messages, self.queue, timings=timings)
+            except Exception as exc:
+                # Failed batch is passed to module again one message at a time,
+                #  so only the message that fails is lost
+                log.exception("%s failed to process batch: %s", module_stats.name, exc)
+                processed = self.retry_messages(m_module, messages)
+                timings = None
+            module_stats.add(len(messages), len(processed), time.time() - start_time, timings)
+            messages = processed
+
+    def retry_messages(self, m_module, messages):
+        processed = []
+        for message in messages:
+            try:
+                processed.extend(m_module.process_batch([message], self.queue))
+            except Exception as exc:
+                log.exception("%s failed to process message %s: %s", m_module.__class__.__name__,
+                              message.get('id'), exc)
+        return processed
+
+    def dispatch(self, message):
+        # Id is assigned here, as dispatcher is the only thread
+        #  that sees every message in order of arrival
         if 'id' not in message:
             message['id'] = self.msg_counter
             self.msg_counter += 1
-        # When we receive message we pass it via all loaded modules
-        # All modules should return the message with modified/not modified
-        #  content so it can be passed to new module, or to pass to CLI
-
-        for m_module in self.modules:
-            message = m_module.process_message(message, self.queue)
+        shard = hash(shard_key(message)) % len(self.threads)
+        self.threads[shard].queue.put(message)
 
     def run(self):
-        for thread in range(THREADS):
-            self.threads.append(MessageHandler(self.queue, self.msg_process))
+        # Every handler has its own queue, so messages within one shard
+        #  are processed strictly in order, while different shards
+        #  are processed in parallel
+        for thread in range(self.workers):
+            shard_queue = MessageQueue(SHARD_QUEUE_SIZE, defer_commands=False)
+            self.threads.append(MessageHandler(shard_queue, self.batch_process,
+                                               batch_size=self.batch_size, batch_timeout=self.batch_timeout))
             self.threads[thread].start()
 
+        if self.stats_interval > 0:
+            StatsLogger(self.stats, self.stats_interval).start()
+
+        while True:
+            self.dispatch(self.queue.get())
+            self.queue.task_done()
+
+    def wait_processed(self):
+        # Modules can put new messages to main queue while processing,
+        #  so waiting until every queue is empty at the same time
+        while True:
+            self.queue.join()
+            for thread in self.threads:
+                thread.queue.join()
+            if not self.queue.unfinished_tasks:
+                break
+
+    def get_stats(self):
+        stats = OrderedDict()
+        stats['queue'] = self.queue.qsize()
+        stats['dropped'] = getattr(self.queue, 'dropped', 0)
+        stats['shards'] = [thread.queue.qsize() for thread in self.threads]
+        stats['modules'] = OrderedDict()
+        for m_module, module_stats in self.stats.items():
+            if m_module in self.modules:
+                stats['modules'][module_stats.name] = module_stats.to_dict()
+        return stats
+
+    def rest_get_stats(self, *args, **kwargs):
+        return json.dumps(self.get_stats())
+
+    def rest_reset_stats(self, *args, **kwargs):
+        for module_stats in self.stats.values():
+            module_stats.reset()
+        return json.dumps(self.get_stats())
+
@@ -15,6 +15,8 @@ from collections import OrderedDict
 from modules.helper.parser import load_from_config_file
 from modules.helper.system import system_message, translate_key, remove_message_by_id, EMOTE_FORMAT, NA_MESSAGE
 from modules.helper.module import ChatModule
+from modules.helper.message import ChatMessage
+from modules.helper.testing import push_messages
 from ws4py.client.threadedclient import WebSocketClient
 from gui import MODULE_KEY
 
@@ -64,6 +66,7 @@ class GoodgameMessageHandler(threading.Thread):
     def run(self):
         while True:
             self.process_message(self.gg_queue.get())
+            self.gg_queue.task_done()
 
     def process_message(self, msg):
         message_type = msg['type']
@@ -85,13 +88,13 @@ class GoodgameMessageHandler(threading.Thread):
     def _process_message(self, msg):
         # Getting all needed data from received message
         # and sending it to queue for further message handling
-        comp = {'id': ID_PREFIX.format(msg['data']['message_id']),
-                'source': self.source,
-                'source_icon': SOURCE_ICON,
-                'user': msg['data']['user_name'],
-                'text': msg['data']['text'],
-                'emotes': {},
-                'type': 'message'}
+        comp = ChatMessage(id=ID_PREFIX.format(msg['data']['message_id']),
+                           source=self.source,
+                           source_icon=SOURCE_ICON,
+                           user=msg['data']['user_name'],
+                           text=msg['data']['text'],
+                           emotes={},
+                           type='message')
 
         self._process_smiles(comp, msg)
 
@@ -116,7 +119,8 @@ class GoodgameMessageHandler(threading.Thread):
 
     def _process_remove_message(self, msg):
         remove_id = ID_PREFIX.format(msg['data']['message_id'])
-        self.message_queue.put(remove_message_by_id([remove_id], text=self.kwargs['settings'].get('remove_text')))
+        self.message_queue.put(remove_message_by_id([remove_id], text=self.kwargs['settings'].get('remove_text'),
+                                                    source=self.source, channel=self.ws_class.main_thread.nick))
 
     def _process_user_ban(self, msg):
         if msg['data']['duration']:
@@ -146,6 +150,7 @@ class GoodgameMessageHandler(threading.Thread):
             log.exception(exc)
 
     def _post_process_multiple_channels(self, message):
+        message['channel'] = self.ws_class.main_thread.nick
         if self.chat_module.conf_params()['config']['config']['show_channel_names']:
             message['channel_name'] = self.ws_class.main_thread.nick
 
@@ -358,6 +363,7 @@ class TestGG(threading.Thread):
         super(TestGG, self).__init__()
         self.main_class = main_class  # type: goodgame
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.gg_handler = None
 
     def run(self):
@@ -377,6 +383,9 @@ class TestGG(threading.Thread):
 
         self.gg_handler.process_message(gg_message(nickname, text))
 
+    def send_messages(self, *args, **kwargs):
+        return json.dumps({'messages': push_messages(self.send_message, **kwargs)})
+
 
 class goodgame(ChatModule):
     def __init__(self, *args, **kwargs):
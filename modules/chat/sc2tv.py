@@ -11,7 +11,9 @@ import logging
 from collections import OrderedDict
 from ws4py.client.threadedclient import WebSocketClient
 from modules.helper.module import ChatModule
+from modules.helper.message import ChatMessage
 from modules.helper.parser import load_from_config_file
+from modules.helper.testing import push_messages
 from modules.helper.system import system_message, translate_key, EMOTE_FORMAT
 from gui import MODULE_KEY
 
@@ -57,7 +59,7 @@ class FsChat(WebSocketClient):
         self.chat_module = kwargs.get('chat_module')
         self.crit_error = False
 
-        self.channel_id = self.fs_get_id()
+        self.channel_id = kwargs.get('channel_id') or self.fs_get_id()
 
         self.smiles = kwargs.get('smiles')
 
@@ -212,12 +214,12 @@ class FsChat(WebSocketClient):
         try:
             self.duplicates.index(message['id'])
         except ValueError:
-            comp = {'source': self.source,
-                    'source_icon': SOURCE_ICON,
-                    'user': message['from']['name'],
-                    'text': message['text'],
-                    'emotes': [],
-                    'type': 'message'}
+            comp = ChatMessage(source=self.source,
+                               source_icon=SOURCE_ICON,
+                               user=message['from']['name'],
+                               text=message['text'],
+                               emotes=[],
+                               type='message')
             if message['to'] is not None:
                 comp['to'] = message['to']['name']
                 if comp['to'] == self.channel_name:
@@ -249,6 +251,7 @@ class FsChat(WebSocketClient):
         self.chat_module.set_viewers(self.channel_name, message['result']['amount'])
 
     def _post_process_multiple_channels(self, message):
+        message['channel'] = self.channel_name
         if self.chat_module.conf_params()['config']['config']['show_channel_names']:
             message['channel_name'] = self.channel_name
 
@@ -342,6 +345,7 @@ class TestSc2tv(threading.Thread):
         super(TestSc2tv, self).__init__()
         self.main_class = main_class  # type: sc2tv
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.fs_thread = None
 
     def run(self):
@@ -361,6 +365,9 @@ class TestSc2tv(threading.Thread):
 
         self.fs_thread.received_message(Sc2tvMessage(nickname, text))
 
+    def send_messages(self, *args, **kwargs):
+        return json.dumps({'messages': push_messages(self.send_message, **kwargs)})
+
 
 class sc2tv(ChatModule):
     def __init__(self, *args, **kwargs):
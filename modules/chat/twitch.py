@@ -1,5 +1,6 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
 import irc.client
+import json
 import threading
 import os
 import re
@@ -11,6 +12,9 @@ import time
 from collections import OrderedDict
 from modules.helper.parser import load_from_config_file
 from modules.helper.module import ChatModule
+from modules.helper.message import ChatMessage
+from modules.helper.testing import push_messages
+from modules.helper.text import TextEditor, apply_edits
 from modules.helper.system import system_message, translate_key, remove_message_by_user, EMOTE_FORMAT, NA_MESSAGE
 from gui import MODULE_KEY
 
@@ -80,6 +84,7 @@ class TwitchMessageHandler(threading.Thread):
     def run(self):
         while True:
             self.process_message(self.twitch_queue.get())
+            self.twitch_queue.task_done()
 
     def process_message(self, msg):
         # After we receive the message we have to process the tags
@@ -144,7 +149,8 @@ class TwitchMessageHandler(threading.Thread):
 
     def _handle_clearchat(self, msg):
         self.message_queue.put(remove_message_by_user(msg.arguments,
-                                                      text=self.kwargs['settings'].get('remove_text')))
+                                                      text=self.kwargs['settings'].get('remove_text'),
+                                                      source=self.source, channel=self.irc_class.nick))
 
     def _handle_usernotice(self, msg):
         for tag in msg.tags:
@@ -157,14 +163,14 @@ class TwitchMessageHandler(threading.Thread):
             self._handle_message(msg, sub_message=True)
 
     def _handle_message(self, msg, sub_message=False):
-        message = {'source': self.source,
-                   'source_icon': SOURCE_ICON,
-                   'badges': [],
-                   'emotes': [],
-                   'bttv_emotes': {},
-                   'user': msg.source.split('!')[0],
-                   'type': 'message',
-                   'msg_type': msg.type}
+        message = ChatMessage(source=self.source,
+                              source_icon=SOURCE_ICON,
+                              badges=[],
+                              emotes=[],
+                              bttv_emotes={},
+                              user=msg.source.split('!')[0],
+                              type='message',
+                              msg_type=msg.type)
 
         if message['user'] == 'twitchnotify':
             self.irc_class.system_message(msg.arguments.pop(), category='chat')
@@ -222,24 +228,28 @@ class TwitchMessageHandler(threading.Thread):
             'color': color,
             'size': 4
         }
-        message['text'] = message['text'].replace(emote_smile, EMOTE_FORMAT.format(emote_smile))
 
     @staticmethod
     def _handle_sub_message(message):
         message['sub_message'] = True
 
     def _send_message(self, message):
-        self._post_process_emotes(message)
-        self._post_process_bttv_emotes(message)
+        # Emote positions are positions in original text, so all text
+        #  changes are made using them and applied at once
+        editor = TextEditor(message['text'])
+        self._post_process_emotes(message, editor)
+        self._post_process_bttv_emotes(message, editor)
         self._post_process_multiple_channels(message)
-        self._post_process_bits(message)
+        self._post_process_bits(message, editor)
+        apply_edits(message, editor)
         self.message_queue.put(message)
 
     @staticmethod
-    def _post_process_bits(message):
+    def _post_process_bits(message, editor):
         if 'bits' not in message:
             return
         bits = message['bits']
+        editor.replace_all(bits['bits'], EMOTE_FORMAT.format(bits['bits']))
         message['emotes'].append({
             'emote_id': bits['bits'],
             'emote_url': BITS_URL.format(
@@ -251,28 +261,20 @@ class TwitchMessageHandler(threading.Thread):
         })
 
     @staticmethod
-    def _post_process_emotes(message):
-        conveyor_emotes = []
+    def _post_process_emotes(message, editor):
         for emote in message['emotes']:
             for position in emote['positions']:
                 start, end = position.split('-')
-                conveyor_emotes.append({'emote_id': emote['emote_id'],
-                                        'start': int(start),
-                                        'end': int(end)})
-        conveyor_emotes = sorted(conveyor_emotes, key=lambda k: k['start'], reverse=True)
-
-        for emote in conveyor_emotes:
-            message['text'] = u'{start}{emote}{end}'.format(start=message['text'][:emote['start']],
-                                                            end=message['text'][emote['end'] + 1:],
-                                                            emote=EMOTE_FORMAT.format(emote['emote_id']))
+                editor.replace(int(start), int(end) + 1, EMOTE_FORMAT.format(emote['emote_id']))
 
     @staticmethod
-    def _post_process_bttv_emotes(message):
+    def _post_process_bttv_emotes(message, editor):
         for emote, data in message['bttv_emotes'].iteritems():
-            message['text'] = message['text'].replace(emote, EMOTE_FORMAT.format(emote))
+            editor.replace_all(emote, EMOTE_FORMAT.format(emote))
             message['emotes'].append(data)
 
     def _post_process_multiple_channels(self, message):
+        message['channel'] = self.irc_class.nick
         channel_class = self.irc_class.main_class
         if channel_class.chat_module.conf_params()['config']['config']['show_channel_names']:
             message['channel_name'] = channel_class.display_name
@@ -529,10 +531,11 @@ class TwitchMessage(object):
             {'key': u'color', 'value': u'#FFFFFF'},
             {'key': u'display-name', 'value': u'{}'.format(source)},
         ]
+        # emotes and bits can be tag values, True uses default ones
         if emotes:
-            self.tags.append({'key': u'emotes', 'value': u'25:0-4'})
+            self.tags.append({'key': u'emotes', 'value': emotes if isinstance(emotes, basestring) else u'25:0-4'})
         if bits:
-            self.tags.append({'key': u'bits', 'value': u'20'})
+            self.tags.append({'key': u'bits', 'value': bits if isinstance(bits, basestring) else u'20'})
 
 
 class TestTwitch(threading.Thread):
@@ -540,6 +543,7 @@ class TestTwitch(threading.Thread):
         super(TestTwitch, self).__init__()
         self.main_class = main_class  # type: twitch
         self.main_class.rest_add('POST', 'push_message', self.send_message)
+        self.main_class.rest_add('POST', 'push_messages', self.send_messages)
         self.tw_queue = None
 
     def run(self):
@@ -561,6 +565,9 @@ class TestTwitch(threading.Thread):
 
         self.tw_queue.put(TwitchMessage(nickname, text, emotes, bits))
 
+    def send_messages(self, *args, **kwargs):
+        return json.dumps({'messages': push_messages(self.send_message, **kwargs)})
+
 
 class twitch(ChatModule):
     def __init__(self, *args, **kwargs):
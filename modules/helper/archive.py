@@ -0,0 +1,173 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import logging
+import os
+import Queue
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from matcher import to_unicode
+
+log = logging.getLogger('archive')
+# Writer inserts up to BATCH_SIZE messages in one transaction,
+# waits BATCH_INTERVAL seconds for new messages
+BATCH_SIZE = 1000
+BATCH_INTERVAL = 1
+STOP_TIMEOUT = 10
+SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+COLUMNS = ('id', 'timestamp', 'source', 'channel', 'user', 'text')
+# unicode61 tokenizer is not compiled in every sqlite
+FTS_TABLES = (
+    'CREATE VIRTUAL TABLE messages_fts USING fts4(content="messages", text, tokenize=unicode61)',
+    'CREATE VIRTUAL TABLE messages_fts USING fts4(content="messages", text)',
+)
+
+
+def has_fts(db):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is not None
+
+
+def create_archive(db):
+    """
+        Creates archive tables, messages are indexed with FTS4 if sqlite supports it
+    :return: True if full text index is available
+    """
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS messages ('
+               'id INTEGER PRIMARY KEY, timestamp REAL, source TEXT, channel TEXT, '
+               'user TEXT COLLATE NOCASE, text TEXT)')
+    db.execute('CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)')
+    db.execute('CREATE INDEX IF NOT EXISTS messages_user ON messages (user)')
+    if not has_fts(db):
+        for statement in FTS_TABLES:
+            try:
+                db.execute(statement)
+                db.execute('CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN '
+                           'INSERT INTO messages_fts (docid, text) VALUES (new.id, new.text); END')
+                break
+            except sqlite3.OperationalError as exc:
+                log.debug("Unable to create full text index: %s", exc)
+        else:
+            log.warning("SQLite has no FTS4 support, archive search will use LIKE")
+    db.commit()
+    return has_fts(db)
+
+
+def fts_query(text):
+    # Every word is quoted, so user input can't break MATCH syntax
+    return u' '.join(u'"{0}"'.format(word.replace(u'"', u'""')) for word in to_unicode(text).split())
+
+
+def like_pattern(text):
+    text = to_unicode(text).replace(u'\\', u'\\\\').replace(u'%', u'\\%').replace(u'_', u'\\_')
+    return u'%{0}%'.format(text)
+
+
+def search(db_location, user=None, text=None, source=None, start=None, end=None, before=None,
+           limit=SEARCH_LIMIT):
+    """
+        Searches archive, messages are returned newest first
+    :param start: timestamp, messages from start (inclusive)
+    :param end: timestamp, messages before end
+    :param before: message id, next page is requested with id of the last message
+    :return: list of messages
+    """
+    if not os.path.exists(db_location):
+        return []
+    conditions = []
+    params = []
+    if user:
+        conditions.append('user = ?')
+        params.append(to_unicode(user))
+    if source:
+        conditions.append('source = ?')
+        params.append(to_unicode(source))
+    if start is not None:
+        conditions.append('timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append('timestamp < ?')
+        params.append(end)
+    if before is not None:
+        conditions.append('id < ?')
+        params.append(before)
+
+    db = sqlite3.connect(db_location)
+    try:
+        if text and text.strip():
+            if has_fts(db):
+                conditions.append('id IN (SELECT docid FROM messages_fts WHERE messages_fts MATCH ?)')
+                params.append(fts_query(text))
+            else:
+                conditions.append("text LIKE ? ESCAPE '\\'")
+                params.append(like_pattern(text))
+        query = 'SELECT {0} FROM messages'.format(', '.join(COLUMNS))
+        if conditions:
+            query += ' WHERE {0}'.format(' AND '.join(conditions))
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        rows = db.execute(query, params).fetchall()
+    finally:
+        db.close()
+    return [OrderedDict(zip(COLUMNS, row)) for row in rows]
+
+
+class ArchiveWriter(threading.Thread):
+    """
+        Writes log records (timestamp, fields) to sqlite archive
+        in background, records are inserted in batches.
+    """
+    def __init__(self, db_location, batch_size=BATCH_SIZE, batch_interval=BATCH_INTERVAL):
+        super(ArchiveWriter, self).__init__()
+        self.daemon = True
+        self.queue = Queue.Queue()
+        self.db_location = db_location
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join(STOP_TIMEOUT)
+
+    def run(self):
+        db = sqlite3.connect(self.db_location)
+        create_archive(db)
+        running = True
+        while running:
+            batch, running = self._get_batch()
+            if not batch:
+                continue
+            try:
+                self.write(db, batch)
+            except sqlite3.Error as exc:
+                log.exception("Unable to write archive: %s", exc)
+        db.close()
+
+    def _get_batch(self):
+        """
+        :return: (records, False if writer is stopped)
+        """
+        batch = []
+        try:
+            record = self.queue.get(timeout=self.batch_interval)
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                record = self.queue.get_nowait()
+        except Queue.Empty:
+            return batch, True
+        return batch, record is not None
+
+    @staticmethod
+    def write(db, batch):
+        rows = [(timestamp, fields.get('source'), fields.get('channel'),
+                 to_unicode(fields.get('user', u'')), to_unicode(fields.get('text', u'')))
+                for timestamp, fields in batch]
+        with db:
+            db.executemany('INSERT INTO messages (timestamp, source, channel, user, text) VALUES (?, ?, ?, ?, ?)',
+                           rows)
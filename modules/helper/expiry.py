@@ -0,0 +1,95 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import threading
+from collections import OrderedDict
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no monotonic clock
+    from time import time as monotonic
+
+# Window is split into BUCKETS buckets, keys live up to window + window / BUCKETS seconds
+BUCKETS = 16
+
+
+class ExpiringTimes(object):
+    """
+        Keeps last time of every key for window seconds.
+        Keys are grouped into time buckets, the oldest buckets are
+        dropped as a whole when they expire, so every key is
+        expired once and memory only holds keys seen in the window.
+        Methods are thread safe.
+    """
+    def __init__(self, window, buckets=BUCKETS):
+        self.window = window
+        self.bucket_size = float(window) / buckets if window > 0 else 1.0
+        # key: (time, bucket)
+        self.times = {}
+        self.buckets = OrderedDict()
+        self.last_bucket = None
+        self.lock = threading.Lock()
+
+    def _bucket(self, timestamp):
+        bucket = int(timestamp // self.bucket_size)
+        # Buckets are kept in time order even if clock goes back
+        if self.last_bucket is not None and bucket < self.last_bucket:
+            return self.last_bucket
+        self.last_bucket = bucket
+        return bucket
+
+    def expire(self, now):
+        with self.lock:
+            self._expire(now)
+
+    def _expire(self, now):
+        oldest = int((now - self.window) // self.bucket_size)
+        while self.buckets:
+            bucket = next(iter(self.buckets))
+            if bucket >= oldest:
+                break
+            for key in self.buckets.pop(bucket):
+                # Key is only removed if it is still stored in expired bucket
+                if self.times.get(key, (None, None))[1] == bucket:
+                    del self.times[key]
+
+    def _get(self, key, now):
+        if key not in self.times:
+            return None
+        timestamp = self.times[key][0]
+        return timestamp if now - timestamp < self.window else None
+
+    def _set(self, key, now):
+        self._expire(now)
+        if key in self.times:
+            old_bucket = self.buckets.get(self.times[key][1])
+            if old_bucket is not None:
+                old_bucket.discard(key)
+        bucket = self._bucket(now)
+        if bucket not in self.buckets:
+            self.buckets[bucket] = set()
+        self.buckets[bucket].add(key)
+        self.times[key] = (now, bucket)
+
+    def get(self, key, now):
+        """
+        :return: last time of key, None if key wasn't set in window
+        """
+        with self.lock:
+            return self._get(key, now)
+
+    def set(self, key, now):
+        with self.lock:
+            self._set(key, now)
+
+    def swap(self, key, now):
+        """
+            Sets time of key
+        :return: previous time of key, None if key wasn't set in window
+        """
+        with self.lock:
+            timestamp = self._get(key, now)
+            self._set(key, now)
+            return timestamp
+
+    def __len__(self):
+        return len(self.times)
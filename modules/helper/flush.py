@@ -0,0 +1,27 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import logging
+import threading
+import time
+
+log = logging.getLogger('flush')
+FLUSH_INTERVAL = 5
+
+
+class FlushThread(threading.Thread):
+    """
+        Calls flush of module every interval seconds, so module
+        can buffer writes and store them in background
+    """
+    def __init__(self, module, interval=FLUSH_INTERVAL):
+        super(FlushThread, self).__init__()
+        self.daemon = True
+        self.module = module
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.module.flush()
+            except Exception as exc:
+                log.exception("Unable to flush %s: %s", self.module.__class__.__name__, exc)
@@ -0,0 +1,120 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import bisect
+import gzip
+import logging
+import os
+import Queue
+import threading
+
+log = logging.getLogger('logfile')
+INDEX_EXTENSION = '.idx'
+GZIP_EXTENSION = '.gz'
+READ_SIZE = 64 * 1024
+
+
+def index_path(file_path):
+    return file_path + INDEX_EXTENSION
+
+
+def add_index(file_path, entries):
+    """
+        Appends (timestamp, offset) entries to index of log file,
+        offset is position in file where lines from timestamp start
+    """
+    with open(index_path(file_path), 'a') as index_file:
+        index_file.writelines('{0:.3f} {1}\n'.format(timestamp, offset) for timestamp, offset in entries)
+
+
+def read_index(file_path):
+    entries = []
+    if not os.path.exists(index_path(file_path)):
+        return entries
+    with open(index_path(file_path)) as index_file:
+        for line in index_file:
+            try:
+                timestamp, offset = line.split()
+                entries.append((float(timestamp), int(offset)))
+            except ValueError:
+                continue
+    return entries
+
+
+def compress_log(file_path):
+    """
+        Compresses closed log file into file_path.gz, every indexed part
+        of file is written as separate gzip member, so reading can start
+        from any indexed timestamp without decompressing previous parts.
+        If .gz file already exists new members are appended to it.
+    """
+    gz_path = file_path + GZIP_EXTENSION
+    size = os.path.getsize(file_path)
+    entries = [(timestamp, offset) for timestamp, offset in read_index(file_path) if offset < size]
+    starts = sorted(set([0] + [offset for _, offset in entries]))
+    members = {}
+
+    with open(file_path, 'rb') as raw_file, open(gz_path, 'ab') as gz_file:
+        gz_file.seek(0, os.SEEK_END)
+        for index, start in enumerate(starts):
+            end = starts[index + 1] if index + 1 < len(starts) else size
+            if end <= start:
+                continue
+            members[start] = gz_file.tell()
+            raw_file.seek(start)
+            member = gzip.GzipFile(filename='', mode='wb', fileobj=gz_file)
+            remaining = end - start
+            while remaining > 0:
+                data = raw_file.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                member.write(data)
+                remaining -= len(data)
+            member.close()
+
+    add_index(gz_path, [(timestamp, members[offset]) for timestamp, offset in entries if offset in members])
+    os.remove(file_path)
+    if os.path.exists(index_path(file_path)):
+        os.remove(index_path(file_path))
+    log.info("Compressed %s", file_path)
+
+
+def read_log(file_path, timestamp=None):
+    """
+        Reads lines of log file, compressed or not
+    :param timestamp: lines are read starting from the last indexed
+      part that begins before timestamp
+    :return: generator of lines
+    """
+    offset = 0
+    entries = read_index(file_path)
+    if timestamp is not None and entries:
+        index = bisect.bisect_right([entry[0] for entry in entries], timestamp) - 1
+        if index >= 0:
+            offset = entries[index][1]
+
+    with open(file_path, 'rb') as log_file:
+        log_file.seek(offset)
+        if file_path.endswith(GZIP_EXTENSION):
+            log_file = gzip.GzipFile(filename='', mode='rb', fileobj=log_file)
+        for line in log_file:
+            yield line
+
+
+class LogCompressor(threading.Thread):
+    """
+        Compresses closed log files in background
+    """
+    def __init__(self):
+        super(LogCompressor, self).__init__()
+        self.daemon = True
+        self.queue = Queue.Queue()
+
+    def put(self, file_path):
+        self.queue.put(file_path)
+
+    def run(self):
+        while True:
+            file_path = self.queue.get()
+            try:
+                compress_log(file_path)
+            except Exception as exc:
+                log.exception("Unable to compress %s: %s", file_path, exc)
@@ -0,0 +1,222 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import itertools
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger('matcher')
+REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+TRIE_END = ''
+# Every SAMPLE_INTERVAL text is also checked by every rule separately to measure rule cost
+SAMPLE_INTERVAL = 1000
+
+
+def to_unicode(text):
+    if isinstance(text, unicode):
+        return text
+    return str(text).decode('utf-8')
+
+
+def is_literal(rule):
+    return not REGEX_CHARS.intersection(rule)
+
+
+def _trie_pattern(node):
+    """
+        Builds regex from trie of literals, so regex engine checks
+        every character of text once instead of trying every literal
+    :return: pattern (unicode), None if node has no children
+    """
+    branches = []
+    chars = []
+    for char in sorted(key for key in node if key != TRIE_END):
+        child = _trie_pattern(node[char])
+        if child is None:
+            chars.append(re.escape(char))
+        else:
+            branches.append(re.escape(char) + child)
+    if chars:
+        branches.append(chars[0] if len(chars) == 1 else u'[{0}]'.format(u''.join(chars)))
+    if not branches:
+        return None
+
+    pattern = branches[0] if len(branches) == 1 else u'(?:{0})'.format(u'|'.join(branches))
+    if TRIE_END in node:
+        # Longer literal is tried first, shorter one still matches
+        pattern = u'(?:{0})?'.format(pattern)
+    return pattern
+
+
+def literal_pattern(literals, flags=0):
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[TRIE_END] = True
+    return re.compile(_trie_pattern(trie), re.UNICODE | flags)
+
+
+class RuleMatcher(object):
+    """
+        Matches text against list of rules (regular expressions) at once.
+        Rules without special characters are joined into one literal pattern,
+        matched literal is looked up in dict.
+        Other rules are joined into one alternation, rules with groups or
+        inline flags can't be joined and are checked one by one.
+        Hits are counted per rule, time is measured per rule on sampled texts.
+        Anchored matcher only matches rules at the beginning of text (re.match).
+        Ordered matcher returns the first matching rule in rules order, matched
+        text is checked again by rules that precede the found one.
+    """
+    def __init__(self, rules, sample_interval=SAMPLE_INTERVAL, flags=0, anchored=False, ordered=False):
+        self.flags = re.UNICODE | flags
+        self.ignore_case = bool(flags & re.IGNORECASE)
+        self.anchored = anchored
+        self.ordered = ordered
+        self.rules = []
+        self.compiled = OrderedDict()
+        self.sample_interval = sample_interval
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.time = {}
+        self.samples = {}
+
+        self.literals = {}
+        self.literal_regex = None
+        self.combined = []
+        self.combined_regex = None
+        self.separate = []
+
+        for rule in rules:
+            try:
+                self._add_rule(to_unicode(rule))
+            except (re.error, UnicodeDecodeError) as exc:
+                log.warning("Unable to compile rule %r: %s", rule, exc)
+
+        if self.literals:
+            self.literal_regex = literal_pattern(self.literals, self.flags)
+        if self.combined:
+            self.combined_regex = re.compile(u'|'.join(u'(?:{0})'.format(rule) for rule, _ in self.combined),
+                                             self.flags)
+
+    def _add_rule(self, rule):
+        # Empty rule would match every message
+        if not rule or rule in self.compiled:
+            return
+        if is_literal(rule):
+            self.literals[rule.lower() if self.ignore_case else rule] = rule
+            compiled = re.compile(re.escape(rule), self.flags)
+        else:
+            compiled = re.compile(rule, self.flags)
+            if compiled.groups or '(?' in rule:
+                self.separate.append((rule, compiled))
+            else:
+                self.combined.append((rule, compiled))
+        self.compiled[rule] = compiled
+        self.rules.append(rule)
+        self.hits[rule] = 0
+        self.time[rule] = 0.0
+        self.samples[rule] = 0
+
+    def search(self, text):
+        """
+        :param text: text to check, unicode or utf-8 encoded
+        :return: first found rule, None if nothing matches
+        """
+        if not self.rules:
+            return None
+        text = to_unicode(text)
+        if self.sample_interval and next(self.counter) % self.sample_interval == 0:
+            self._sample(text)
+
+        rule = self._search(text)
+        if rule is not None and self.ordered:
+            rule = self._first_rule(text, rule)
+        if rule is not None:
+            with self.lock:
+                self.hits[rule] += 1
+        return rule
+
+    def _sample(self, text):
+        timings = []
+        for rule, compiled in self.compiled.iteritems():
+            start_time = time.time()
+            self._find(compiled, text)
+            timings.append((rule, time.time() - start_time))
+        with self.lock:
+            for rule, elapsed in timings:
+                self.time[rule] += elapsed
+                self.samples[rule] += 1
+
+    def _first_rule(self, text, found):
+        for rule, compiled in self.compiled.iteritems():
+            if rule == found or self._find(compiled, text):
+                return rule
+        return found
+
+    def _find(self, compiled, text):
+        if self.anchored:
+            return compiled.match(text)
+        return compiled.search(text)
+
+    def _search(self, text):
+        if self.literal_regex:
+            match = self._find(self.literal_regex, text)
+            if match:
+                return self.literals[match.group().lower() if self.ignore_case else match.group()]
+
+        if self.combined_regex:
+            match = self._find(self.combined_regex, text)
+            if match:
+                # Alternative that matched is the first one that matches at the same position
+                for rule, compiled in self.combined:
+                    if compiled.match(text, match.start()):
+                        return rule
+
+        for rule, compiled in self.separate:
+            if self._find(compiled, text):
+                return rule
+        return None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def inherit_stats(self, matcher):
+        """
+            Takes statistics of rules that are kept from previous matcher
+        """
+        if matcher is None:
+            return
+        with matcher.lock:
+            for rule in self.rules:
+                self.hits[rule] = matcher.hits.get(rule, 0)
+                self.time[rule] = matcher.time.get(rule, 0.0)
+                self.samples[rule] = matcher.samples.get(rule, 0)
+
+    def reset_stats(self):
+        with self.lock:
+            for rule in self.rules:
+                self.hits[rule] = 0
+                self.time[rule] = 0.0
+                self.samples[rule] = 0
+
+    def get_stats(self):
+        """
+        :return: list of rule statistics in rules order, avg_us is average
+          time rule takes to check one text
+        """
+        with self.lock:
+            stats = []
+            for rule in self.rules:
+                rule_stats = OrderedDict()
+                rule_stats['rule'] = rule
+                rule_stats['hits'] = self.hits[rule]
+                rule_stats['samples'] = self.samples[rule]
+                rule_stats['avg_us'] = round(self.time[rule] * 1000000 / self.samples[rule], 3) \
+                    if self.samples[rule] else 0.0
+                stats.append(rule_stats)
+            return stats
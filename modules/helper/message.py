@@ -0,0 +1,108 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+
+# Keys that are stored in slots, everything else goes to extra dict
+MESSAGE_FIELDS = (
+    'id', 'type', 'msg_type', 'source', 'source_icon', 'channel', 'channel_name',
+    'user', 'display_name', 'text', 'to', 'timestamp', 'flags',
+    'emotes', 'bttv_emotes', 'badges', 'bits', 'nick_color',
+    'pm', 'mention', 'sub_message', 'system_msg', 'levels', 's_levels')
+MESSAGE_FIELDS_SET = frozenset(MESSAGE_FIELDS)
+
+
+class ChatMessage(object):
+    """
+        Chat message that can be used as a dict by messaging modules.
+        Known keys are stored in slots, so message takes less memory
+        than a dict and is cheaper to copy, unknown keys are stored in
+        additional dict that is created only when it is needed.
+    """
+    __slots__ = MESSAGE_FIELDS + ('_extra',)
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.iteritems():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in MESSAGE_FIELDS_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return self._get_extra()[key]
+
+    def __setitem__(self, key, value):
+        if key in MESSAGE_FIELDS_SET:
+            setattr(self, key, value)
+        else:
+            try:
+                self._extra[key] = value
+            except AttributeError:
+                self._extra = {key: value}
+
+    def __delitem__(self, key):
+        if key in MESSAGE_FIELDS_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            del self._get_extra()[key]
+
+    def __contains__(self, key):
+        if key in MESSAGE_FIELDS_SET:
+            return hasattr(self, key)
+        return key in self._get_extra()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return 'ChatMessage({0!r})'.format(self.to_dict())
+
+    def _get_extra(self):
+        try:
+            return self._extra
+        except AttributeError:
+            return {}
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def keys(self):
+        keys = [key for key in MESSAGE_FIELDS if hasattr(self, key)]
+        keys.extend(self._get_extra().keys())
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def copy(self):
+        return ChatMessage(**self.to_dict())
+
+    def to_dict(self):
+        return dict(self.items())
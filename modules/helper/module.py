@@ -1,10 +1,14 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
 import copy
+import logging
 import os
+import time
 from collections import OrderedDict
 from parser import save_settings, load_from_config_file
 from system import RestApiException, CONF_FOLDER
 
+log = logging.getLogger('module')
+
 BASE_DICT = {
     'custom_renderer': False
 }
@@ -21,6 +25,7 @@ class BaseModule:
 
         self._loaded_modules = {}
         self._rest_api = {}
+        self._cli_commands = {}
         self._module_name = self.__class__.__name__
         self._load_queue = {}
 
@@ -110,14 +115,67 @@ class BaseModule:
 
         self._rest_api[method][path] = function_to_call
 
+    def cli_commands(self):
+        return self._cli_commands
+
+    def cli_add(self, command, function_to_call):
+        """
+        Cli add function will register command for command line
+          interface (> %module_name% $command args)
+        :param command: command name
+        :param function_to_call: what function cli will trigger, it receives
+          list of command arguments and returns text to show
+        """
+        if command in self._cli_commands:
+            raise RestApiException('Command already taken')
+
+        self._cli_commands[command] = function_to_call
+
 
 class MessagingModule(BaseModule):
     def __init__(self, *args, **kwargs):
         BaseModule.__init__(self, *args, **kwargs)
 
+    def message_types(self):
+        """
+            Override this method
+        :return: Message types module processes (list), None if module processes all types
+        """
+        return None
+
     def process_message(self, message, queue, **kwargs):
         return message
 
+    def process_batch(self, messages, queue, **kwargs):
+        """
+            Override this method if module can process messages in bulk
+        :param messages: list of messages in the order they were received
+        :param queue: main queue
+        :param timings: optional list, time of every process_message call is appended to it
+        :return: list of messages that should be passed further, dropped messages are omitted,
+          message that raised exception is dropped and logged
+        """
+        timings = kwargs.pop('timings', None)
+        processed = []
+        for message in messages:
+            start_time = time.time()
+            try:
+                message = self.process_message(message, queue, **kwargs)
+            except Exception as exc:
+                log.exception("%s failed to process message %s: %s", self._module_name, message.get('id'), exc)
+                message = None
+            if timings is not None:
+                timings.append(time.time() - start_time)
+            if message:
+                processed.append(message)
+        return processed
+
+    def has_batch_hook(self):
+        """
+        :return: True if module overrides process_batch, so messages can't be timed one by one
+        """
+        return self.__class__.process_batch.im_func is not MessagingModule.process_batch.im_func
+
 
 class ChatModule(BaseModule):
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,108 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import gzip
+import json
+import logging
+import threading
+import time
+from message import ChatMessage
+
+log = logging.getLogger('replay')
+FLUSH_INTERVAL = 5
+# System messages that messaging modules send are not recorded,
+#  they are sent again when recording is replayed
+SKIP_CATEGORIES = ['module']
+SESSION_MARKER = 'session'
+
+
+class MessageRecorder(object):
+    """
+        Records everything that is put to the main queue into gzipped
+        file, one JSON list per line: [seconds since start, message].
+        Every run appends to file and starts with ["session", start time]
+        line, offsets of messages start from 0 in every session.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = gzip.open(file_path, 'ab')
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.flush_time = self.start_time
+        self.file.write(json.dumps([SESSION_MARKER, self.start_time]) + '\n')
+        self.count = 0
+        log.info("Recording messages to %s", file_path)
+
+    def record(self, message):
+        if message.get('type') == 'system_message' and message.get('category') in SKIP_CATEGORIES:
+            return
+        now = time.time()
+        line = json.dumps([round(now - self.start_time, 4), dict(message)])
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + '\n')
+            self.count += 1
+            if now - self.flush_time > FLUSH_INTERVAL:
+                self.file.flush()
+                self.flush_time = now
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                log.info("Recorded %s messages to %s", self.count, self.file_path)
+
+
+def load_message(message):
+    if message.get('type') != 'message':
+        return message
+    chat_message = ChatMessage()
+    chat_message.update(message)
+    return chat_message
+
+
+def read_records(file_path):
+    """
+        Reads recording made by MessageRecorder, sessions are joined
+        one after another, so offsets never go back
+    :return: generator of (offset in seconds, message)
+    """
+    session_start = 0
+    last_offset = 0
+    with gzip.open(file_path, 'rb') as record_file:
+        try:
+            for line in record_file:
+                if not line.strip():
+                    continue
+                offset, message = json.loads(line)
+                if offset == SESSION_MARKER:
+                    session_start = last_offset
+                    continue
+                last_offset = session_start + offset
+                yield last_offset, load_message(message)
+        except (IOError, EOFError, ValueError) as exc:
+            # Recording was not closed properly, using everything that was flushed
+            log.warning("Recording %s is truncated: %s", file_path, exc)
+
+
+class Replayer(object):
+    """
+        Puts recorded messages to queue, speed is multiplier of recorded
+        pace, 0 means as fast as possible
+    """
+    def __init__(self, file_path, queue, speed=1.0):
+        self.file_path = file_path
+        self.queue = queue
+        self.speed = float(speed)
+        self.count = 0
+
+    def run(self):
+        start_time = time.time()
+        for offset, message in read_records(self.file_path):
+            if self.speed > 0:
+                delay = start_time + offset / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.queue.put(message)
+            self.count += 1
+        return self.count
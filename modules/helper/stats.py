@@ -0,0 +1,74 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import threading
+from collections import deque, OrderedDict
+
+SAMPLES_SIZE = 1000
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class ModuleStats(object):
+    """
+        Collects counters and latency samples of one module in messaging chain.
+        Latency is kept for last SAMPLES_SIZE samples in milliseconds, samples are
+        per message, or per process_batch call for modules with own batch hook (batch).
+    """
+    def __init__(self, name, samples_size=SAMPLES_SIZE, batch=False):
+        self.name = name
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=samples_size)
+        self.calls = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.total_time = 0.0
+
+    def add(self, messages_in, messages_out, elapsed, timings=None):
+        """
+        :param elapsed: time of the whole process_batch call
+        :param timings: time of every message, batch time is the sample if not set
+        """
+        if not messages_in:
+            return
+        with self.lock:
+            self.calls += 1
+            self.messages_in += messages_in
+            self.messages_out += messages_out
+            self.total_time += elapsed
+            if timings is None:
+                self.samples.append(elapsed * 1000)
+            else:
+                self.samples.extend(timing * 1000 for timing in timings)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.calls = 0
+            self.messages_in = 0
+            self.messages_out = 0
+            self.total_time = 0.0
+
+    def to_dict(self):
+        with self.lock:
+            samples = list(self.samples)
+            stats = OrderedDict()
+            stats['latency'] = 'batch' if self.batch else 'message'
+            stats['calls'] = self.calls
+            stats['in'] = self.messages_in
+            stats['out'] = self.messages_out
+            stats['drops'] = self.messages_in - self.messages_out
+            stats['total_ms'] = round(self.total_time * 1000, 3)
+        stats['p50_ms'] = round(percentile(samples, 50), 3)
+        stats['p99_ms'] = round(percentile(samples, 99), 3)
+        return stats
+
+    def __str__(self):
+        stats = self.to_dict()
+        return '{0}: in {1}, out {2}, drops {3}, {6} p50 {4}ms, p99 {5}ms'.format(
+            self.name, stats['in'], stats['out'], stats['drops'], stats['p50_ms'], stats['p99_ms'], stats['latency'])
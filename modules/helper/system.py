@@ -28,6 +28,12 @@ LOG_FORMAT = logging.Formatter("%(asctime)s [%(name)s] [%(levelname)s]  %(messag
 log = logging.getLogger('system')
 
 THREADS = 2
+BATCH_SIZE = 50
+BATCH_TIMEOUT = 10
+STATS_INTERVAL = 300
+QUEUE_SIZE = 10000
+QUEUE_POLICY = 'block'
+RECORD_FILE = ''
 
 SOURCE = 'sy'
 SOURCE_USER = 'System'
@@ -36,6 +42,8 @@ SOURCE_ICON = '/img/sources/lalka_cup.png'
 NA_MESSAGE = 'N/A'
 
 IGNORED_TYPES = ['command', 'system_message']
+CHAT_TYPES = ['message']
+MESSAGE_TYPES = CHAT_TYPES + IGNORED_TYPES
 TRANSLATIONS = {}
 SPLIT_TRANSLATION = '='
 MODULE_KEY = '.'
@@ -142,20 +150,24 @@ def random_string(length):
     return ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(length))
 
 
-def remove_message_by_user(user, text=None):
+def remove_message_by_user(user, text=None, source=None, channel=None):
     command = {'type': 'command',
                'command': 'remove_by_user',
-               'user': user}
+               'user': user,
+               'source': source,
+               'channel': channel}
     if text:
         command['text'] = text
         command['command'] = 'replace_by_user'
     return command
 
 
-def remove_message_by_id(ids, text=None):
+def remove_message_by_id(ids, text=None, source=None, channel=None):
     command = {'type': 'command',
                'command': 'remove_by_id',
-               'ids': ids}
+               'ids': ids,
+               'source': source,
+               'channel': channel}
     if text:
         command['text'] = text
         command['command'] = 'replace_by_id'
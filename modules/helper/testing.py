@@ -0,0 +1,140 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import random
+import threading
+import time
+
+EVENT_MESSAGE = 'message'
+EVENT_SUB = 'sub'
+EVENT_CLEAR = 'clear'
+
+WORDS = ['hello', 'chat', 'stream', 'gg', 'wp', 'lol', 'nice', 'play', 'what', 'is', 'this',
+         'game', 'go', 'top', 'kek', 'streamer', 'when', 'next', 'mid', 'pls', 'ez', 'why']
+BITS_AMOUNTS = [1, 10, 100, 1000, 5000, 10000]
+
+
+class LoadEvent(object):
+    """
+        Chat event produced by LoadMix, source independent.
+        emotes are indexes of words that connector should replace with its emotes.
+    """
+    def __init__(self, kind, channel, user, words=None, emotes=None, bits=0):
+        self.kind = kind
+        self.channel = channel
+        self.user = user
+        self.words = words or []
+        self.emotes = emotes or []
+        self.bits = bits
+
+
+class LoadMix(object):
+    """
+        Generates random chat events with configured proportions:
+            emote_density - share of words that are emotes
+            bits - share of messages with bits
+            subs - share of events that are sub notices
+            clearchat - share of events that are clearchat/removal commands
+        Channels are picked uniformly, so channels list sets multi-channel spread.
+    """
+    def __init__(self, channels, emote_density=0.2, bits=0.01, subs=0.01, clearchat=0.005,
+                 users=1000, words=(3, 12), seed=None):
+        self.random = random.Random(seed)
+        self.channels = list(channels)
+        self.emote_density = emote_density
+        self.bits = bits
+        self.subs = subs
+        self.clearchat = clearchat
+        self.users = ['tester_{0}'.format(index) for index in range(users)]
+        self.words = words
+
+    def _words(self):
+        words = [self.random.choice(WORDS) for _ in range(self.random.randint(*self.words))]
+        emotes = [index for index in range(len(words)) if self.random.random() < self.emote_density]
+        return words, emotes
+
+    def next_event(self):
+        channel = self.random.choice(self.channels)
+        user = self.random.choice(self.users)
+        roll = self.random.random()
+        if roll < self.clearchat:
+            return LoadEvent(EVENT_CLEAR, channel, user)
+
+        words, emotes = self._words()
+        if roll < self.clearchat + self.subs:
+            return LoadEvent(EVENT_SUB, channel, user, words, emotes)
+
+        bits = 0
+        if self.random.random() < self.bits:
+            bits = self.random.choice(BITS_AMOUNTS)
+        return LoadEvent(EVENT_MESSAGE, channel, user, words, emotes, bits)
+
+
+def generate_load(mix, send, rate, count=None, duration=None):
+    """
+        Sends events from mix with send function
+    :param rate: events per second, 0 sends as fast as possible
+    :param count: stop after this amount of events
+    :param duration: stop after this amount of seconds
+    :return: amount of sent events
+    """
+    start_time = time.time()
+    sent = 0
+    while True:
+        if count is not None and sent >= count:
+            break
+        if duration is not None and time.time() - start_time >= duration:
+            break
+        if rate > 0:
+            delay = start_time + sent / float(rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        send(mix.next_event())
+        sent += 1
+    return sent
+
+
+class TimedPush(threading.Thread):
+    """
+        Sends messages with send function, message with 'offset' key
+        is sent that many seconds after push has started
+    """
+    def __init__(self, messages, send):
+        super(TimedPush, self).__init__()
+        self.daemon = True
+        self.messages = messages
+        self.send = send
+
+    def run(self):
+        start_time = time.time()
+        for message in self.messages:
+            offset = message.pop('offset', None)
+            if offset:
+                delay = start_time + float(offset) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.send(**message)
+
+
+def push_messages(send, **kwargs):
+    """
+        Bulk push for chat testing classes, messages are taken from
+        JSON array/NDJSON body or from 'messages' key of JSON object,
+        single JSON object with 'text' is pushed as one message.
+        Messages without offsets are sent before request returns,
+        messages with offsets are sent in background.
+    :return: amount of accepted messages
+    """
+    if 'data' in kwargs or 'messages' in kwargs:
+        messages = kwargs.get('data', kwargs.get('messages'))
+    elif 'text' in kwargs:
+        messages = [kwargs]
+    else:
+        messages = []
+    if isinstance(messages, dict):
+        messages = [messages]
+    messages = [message for message in messages if isinstance(message, dict)]
+    push = TimedPush(messages, send)
+    if any(message.get('offset') for message in messages):
+        push.start()
+    else:
+        push.run()
+    return len(messages)
@@ -0,0 +1,112 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import bisect
+
+
+class OffsetMap(object):
+    """
+        Maps ranges of original text to ranges of edited text.
+        Edits are (start, end, replacement length) tuples in original
+        text coordinates, sorted and not overlapping.
+    """
+    def __init__(self, edits):
+        self.edits = edits
+        self.ends = [end for _, end, _ in edits]
+        self.shifts = []
+        shift = 0
+        for start, end, length in edits:
+            shift += length - (end - start)
+            self.shifts.append(shift)
+
+    def remap_range(self, start, end):
+        """
+        :param start: range start in original text
+        :param end: range end (exclusive) in original text
+        :return: (start, end) in edited text, range that was replaced
+          as a whole maps to its replacement, None if range was broken by edit
+        """
+        index = bisect.bisect_right(self.ends, start)
+        shift = self.shifts[index - 1] if index else 0
+        if index < len(self.edits):
+            edit_start, edit_end, length = self.edits[index]
+            if edit_start < end:
+                if edit_start == start and edit_end == end:
+                    return start + shift, start + shift + length
+                return None
+        return start + shift, end + shift
+
+    def remap(self, positions):
+        """
+        :param positions: list of "start-end" strings, end is inclusive (twitch emote positions)
+        :return: list of positions in edited text, broken positions are dropped
+        """
+        remapped = []
+        for position in positions:
+            start, end = position.split('-')
+            new_range = self.remap_range(int(start), int(end) + 1)
+            if new_range:
+                remapped.append(u'{0}-{1}'.format(new_range[0], new_range[1] - 1))
+        return remapped
+
+
+class TextEditor(object):
+    """
+        Collects edits of text in original text coordinates, so every edit
+        can be made using positions of original text. Edits are applied
+        at once when text is needed.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.edits = []
+        self._keys = []
+
+    def replace(self, start, end, replacement):
+        """
+            Records replacement of text[start:end], start == end inserts replacement.
+            Edit that overlaps already recorded one is ignored.
+        :return: True if edit was recorded
+        """
+        index = bisect.bisect_right(self._keys, (start, end))
+        if index and self.edits[index - 1][1] > start:
+            return False
+        if index < len(self.edits) and self.edits[index][0] < end:
+            return False
+        self._keys.insert(index, (start, end))
+        self.edits.insert(index, (start, end, replacement))
+        return True
+
+    def replace_all(self, old, new):
+        """
+            Records replacement of every occurrence of old in original text
+        """
+        if not old:
+            return
+        start = self.text.find(old)
+        while start != -1:
+            self.replace(start, start + len(old), new)
+            start = self.text.find(old, start + len(old))
+
+    def apply(self):
+        parts = []
+        position = 0
+        for start, end, replacement in self.edits:
+            parts.append(self.text[position:start])
+            parts.append(replacement)
+            position = end
+        parts.append(self.text[position:])
+        return ''.join(parts)
+
+    def offset_map(self):
+        return OffsetMap([(start, end, len(replacement)) for start, end, replacement in self.edits])
+
+
+def apply_edits(message, editor):
+    """
+        Sets edited text to message and moves emote positions to edited text
+    """
+    if not editor.edits:
+        return
+    message['text'] = editor.apply()
+    offset_map = editor.offset_map()
+    for emote in message.get('emotes', []):
+        if 'positions' in emote:
+            emote['positions'] = offset_map.remap(emote['positions'])
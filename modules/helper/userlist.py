@@ -0,0 +1,116 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger('userlist')
+# Beginning of file and bytes before the read offset are compared
+# to tell appended file from rewritten one
+HEAD_SIZE = 256
+MARK_SIZE = 1024
+CHECK_INTERVAL = 5
+
+
+def parse_names(data):
+    names = set()
+    for line in data.splitlines():
+        name = line.strip()
+        if name and not name.startswith('#'):
+            names.add(name.decode('utf-8', 'replace').lower())
+    return names
+
+
+class UserList(object):
+    """
+        Set of user names (lowercase) loaded from external file, one name per line,
+        lines starting with # are ignored.
+        If file only had lines appended since last load, only new lines are read,
+        file is treated as appended if its beginning and bytes before the last
+        read offset are the same.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.names = set()
+        # Last line without newline, it is read again when file grows
+        self.tail = None
+        self.offset = 0
+        self.head = ''
+        self.mark = ''
+        self.size = None
+        self.mtime = None
+        self.reload()
+
+    def __contains__(self, name):
+        return name in self.names or name == self.tail
+
+    def __len__(self):
+        return len(self.names)
+
+    def reload(self):
+        """
+        :return: True if list was changed
+        """
+        with self.lock:
+            try:
+                stat = os.stat(self.file_path)
+            except OSError:
+                if self.mtime is not None:
+                    log.warning("User list %s is not available", self.file_path)
+                    self._set(set(), None, 0, '', '', None)
+                return False
+
+            if stat.st_mtime == self.mtime and stat.st_size == self.size:
+                return False
+
+            with open(self.file_path, 'rb') as list_file:
+                head = list_file.read(HEAD_SIZE)
+                appended = self.offset and stat.st_size >= self.offset and head.startswith(self.head)
+                if appended:
+                    list_file.seek(self.offset - len(self.mark))
+                    appended = self.mark.endswith('\n') and list_file.read(len(self.mark)) == self.mark
+                list_file.seek(self.offset if appended else 0)
+                data = list_file.read()
+
+            end = data.rfind('\n') + 1
+            tail = parse_names(data[end:])
+            tail = tail.pop() if tail else None
+            if appended:
+                self.names.update(parse_names(data[:end]))
+                self._set(self.names, tail, self.offset + end, self.head, (self.mark + data[:end])[-MARK_SIZE:], stat)
+                log.debug("User list %s: loaded appended names, %s total", self.file_path, len(self.names))
+            else:
+                names = parse_names(data[:end])
+                self._set(names, tail, end, head[:end], data[:end][-MARK_SIZE:], stat)
+                log.info("User list %s: loaded %s names", self.file_path, len(names))
+            return True
+
+    def _set(self, names, tail, offset, head, mark, stat):
+        self.names = names
+        self.tail = tail
+        self.offset = offset
+        self.head = head
+        self.mark = mark
+        self.size = stat.st_size if stat else None
+        self.mtime = stat.st_mtime if stat else None
+
+
+class UserListWatcher(threading.Thread):
+    """
+        Checks user lists for changes every interval seconds
+    """
+    def __init__(self, interval=CHECK_INTERVAL):
+        super(UserListWatcher, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.lists = []
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            for user_list in list(self.lists):
+                try:
+                    user_list.reload()
+                except Exception as exc:
+                    log.exception("Unable to reload user list %s: %s", user_list.file_path, exc)
@@ -1,31 +1,115 @@
 # This Python file uses the following encoding: utf-8
 # -*- coding: utf-8 -*-
 # Copyright (C) 2016   CzT/Vladislav Ivanov
-import re
-from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, Counter
+from modules.helper.matcher import RuleMatcher, to_unicode
 from modules.helper.module import MessagingModule
-from modules.helper.system import IGNORED_TYPES
+from modules.helper.system import CHAT_TYPES, CONF_FOLDER
+from modules.helper.text import TextEditor, apply_edits
+from modules.helper.userlist import UserList, UserListWatcher
 
+log = logging.getLogger('blacklist')
 DEFAULT_PRIORITY = 30
 
 CONF_DICT = OrderedDict()
 CONF_DICT['gui_information'] = {
     'category': 'messaging',
     'id': DEFAULT_PRIORITY}
-CONF_DICT['main'] = {'message': 'ignored message'}
+# Shadow mode only tags messages with blacklist action and rule
+CONF_DICT['main'] = {'message': 'ignored message', 'shadow': False}
 CONF_DICT['users_hide'] = []
 CONF_DICT['users_block'] = []
 CONF_DICT['words_hide'] = []
 CONF_DICT['words_block'] = []
+# External files with one user name per line, path is relative to config folder
+CONF_DICT['files'] = OrderedDict()
+CONF_DICT['files']['users_hide'] = ''
+CONF_DICT['files']['users_block'] = ''
+USER_KEYS = ['users_hide', 'users_block']
+ACTION_HIDE = 'hide'
+ACTION_BLOCK = 'block'
 
 
 class blacklist(MessagingModule):
     def __init__(self, *args, **kwargs):
         MessagingModule.__init__(self, *args, **kwargs)
+        self.hide_matcher = None
+        self.block_matcher = None
+        self.users = {}
+        self.user_lists = {}
+        self.user_hits = dict((key, Counter()) for key in USER_KEYS)
+        self.stats_lock = threading.Lock()
+        self.watcher = UserListWatcher()
+        self._build_rules()
+        self.watcher.start()
+
+        self.rest_add('GET', 'stats', self.rest_get_stats)
+        self.rest_add('DELETE', 'stats', self.rest_reset_stats)
+
+    def _config(self, section):
+        # Config is empty when blacklist.cfg doesn't exist
+        return self._conf_params['config'].get(section, CONF_DICT[section])
+
+    def _build_rules(self):
+        hide_matcher = RuleMatcher(self._config('words_hide'))
+        hide_matcher.inherit_stats(self.hide_matcher)
+        block_matcher = RuleMatcher(self._config('words_block'))
+        block_matcher.inherit_stats(self.block_matcher)
+        self.hide_matcher = hide_matcher
+        self.block_matcher = block_matcher
+
+        user_lists = {}
+        for key in USER_KEYS:
+            self.users[key] = set(to_unicode(user).lower() for user in self._config(key))
+            file_path = self._config('files').get(key)
+            if file_path:
+                file_path = os.path.join(CONF_FOLDER, file_path)
+                user_list = self.user_lists.get(key)
+                if user_list is None or user_list.file_path != file_path:
+                    user_list = UserList(file_path)
+                user_lists[key] = user_list
+        self.user_lists = user_lists
+        self.watcher.lists = user_lists.values()
+
+    def _user_in(self, user, key):
+        user_list = self.user_lists.get(key)
+        if user in self.users[key] or (user_list is not None and user in user_list):
+            with self.stats_lock:
+                self.user_hits[key][user] += 1
+            return True
+        return False
+
+    def get_stats(self):
+        stats = OrderedDict()
+        stats['shadow'] = self._config('main').get('shadow', False)
+        stats['words_hide'] = self.hide_matcher.get_stats()
+        stats['words_block'] = self.block_matcher.get_stats()
+        with self.stats_lock:
+            for key in USER_KEYS:
+                stats[key] = dict(self.user_hits[key])
+        return stats
+
+    def rest_get_stats(self, *args, **kwargs):
+        return json.dumps(self.get_stats())
+
+    def rest_reset_stats(self, *args, **kwargs):
+        self.hide_matcher.reset_stats()
+        self.block_matcher.reset_stats()
+        with self.stats_lock:
+            for key in USER_KEYS:
+                self.user_hits[key].clear()
+        return json.dumps(self.get_stats())
 
     def _conf_settings(self, *args, **kwargs):
         return CONF_DICT
 
+    def message_types(self):
+        return CHAT_TYPES
+
     def _gui_settings(self):
         return {
             'words_hide': {
@@ -40,27 +124,47 @@ class blacklist(MessagingModule):
             'users_block': {
                 'view': 'list',
                 'addable': 'true'},
-            'non_dynamic': ['main.*']
+            'non_dynamic': ['main.message']
         }
 
+    def apply_settings(self, **kwargs):
+        MessagingModule.apply_settings(self, **kwargs)
+        self._build_rules()
+
+    def _check_message(self, message):
+        """
+        :return: (action, rule) tuple, (None, None) if message is not blacklisted
+        """
+        user = message['user'].lower()
+        if self._user_in(user, 'users_hide'):
+            return ACTION_HIDE, user
+
+        rule = self.hide_matcher.search(message['text'])
+        if rule is not None:
+            return ACTION_HIDE, rule
+
+        if self._user_in(user, 'users_block'):
+            return ACTION_BLOCK, user
+
+        rule = self.block_matcher.search(message['text'])
+        if rule is not None:
+            return ACTION_BLOCK, rule
+        return None, None
+
     def process_message(self, message, queue, **kwargs):
         if message:
-            if message['type'] in IGNORED_TYPES:
+            action, rule = self._check_message(message)
+            if action is None:
                 return message
 
-            if message['user'].lower() in self._conf_params['config']['users_hide']:
-                return
-
-            for word in self._conf_params['config']['words_hide']:
-                if re.search(word, message['text'].encode('utf-8')):
-                    return
-
-            if message['user'].lower() in self._conf_params['config']['users_block']:
-                message['text'] = self._conf_params['config']['main']['message']
+            log.debug("Message from %s: %s by rule %s", message['user'], action, rule)
+            if self._config('main').get('shadow'):
+                message['blacklist'] = {'action': action, 'rule': rule}
                 return message
 
-            for word in self._conf_params['config']['words_block']:
-                if re.search(word, message['text'].encode('utf-8')):
-                    message['text'] = self._conf_params['config']['main']['message']
-                    return message
+            if action == ACTION_HIDE:
+                return
+            editor = TextEditor(message['text'])
+            editor.replace(0, len(message['text']), self._config('main')['message'])
+            apply_edits(message, editor)
             return message
@@ -3,10 +3,11 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
 import logging
 import random
-import re
 from collections import OrderedDict
+from modules.helper.matcher import literal_pattern, to_unicode
 from modules.helper.module import MessagingModule
-from modules.helper.system import IGNORED_TYPES
+from modules.helper.system import CHAT_TYPES
+from modules.helper.text import TextEditor, apply_edits
 
 DEFAULT_PRIORITY = 10
 log = logging.getLogger('c2b')
@@ -24,49 +25,62 @@ CONF_GUI = {
     'non_dynamic': ['config.*']}
 
 
-def twitch_replace_indexes(filter_name, text, filter_size, replace_size, emotes_list):
-    emotes = []
-    message_index_list = [m.start() for m in re.finditer(filter_name, text)]
+class ReplaceEngine(object):
+    """
+        Replaces all configured phrases in one pass over text, longest
+        phrase wins if phrases overlap. Every phrase gets one random
+        replacement per text.
+    """
+    def __init__(self, config):
+        self.replacements = {}
+        for phrase, replace in config.iteritems():
+            phrase = to_unicode(phrase)
+            if phrase:
+                self.replacements[phrase] = to_unicode(replace).split(u'/')
+        self.regex = literal_pattern(self.replacements) if self.replacements else None
 
-    offset = replace_size - filter_size
-    for emote_data in emotes_list:
-        emote = {'emote_id': emote_data['emote_id'],
-                 'emote_pos': []}
-        for emote_pos in emote_data['emote_pos']:
-            e_start, e_end = emote_pos.split('-')
-            mod_offset = 0
-            for index, item in enumerate(message_index_list):
-                if item < int(e_start):
-                    mod_offset = offset * (index + 1)
-            emote['emote_pos'].append('{0}-{1}'.format(int(e_start) + mod_offset,
-                                                       int(e_end) + mod_offset))
-        emotes.append(emote)
-    return emotes
+    def replace(self, text):
+        """
+        :return: TextEditor with replacements of text
+        """
+        editor = TextEditor(to_unicode(text))
+        if self.regex is None:
+            return editor
+        chosen = {}
+        for match in self.regex.finditer(editor.text):
+            phrase = match.group()
+            if phrase not in chosen:
+                chosen[phrase] = random.choice(self.replacements[phrase])
+            editor.replace(match.start(), match.end(), chosen[phrase])
+        return editor
 
 
 class c2b(MessagingModule):
     def __init__(self, *args, **kwargs):
         MessagingModule.__init__(self, *args, **kwargs)
+        self.engine = None
+        self._build_engine()
+
+    def _build_engine(self):
+        # Config is empty when c2b.cfg doesn't exist, engine replaces nothing then
+        self.engine = ReplaceEngine(self._conf_params['config'].get('config', CONF_DICT['config']))
+
+    def apply_settings(self, **kwargs):
+        MessagingModule.apply_settings(self, **kwargs)
+        self._build_engine()
 
     def process_message(self, message, queue, **kwargs):
         # Replacing the message if needed.
         # Please do the needful
         if message:
-            if message['type'] in IGNORED_TYPES:
-                return message
-
-            for item, replace in self._conf_params['config']['config'].iteritems():
-                if item in message['text']:
-                    replace_word = random.choice(replace.split('/'))
-                    if message['source'] == 'tw':
-                        message['emotes'] = twitch_replace_indexes(item, message['text'],
-                                                                   len(item), len(replace_word),
-                                                                   message.get('emotes', []))
-                    message['text'] = message['text'].replace(item, replace_word)
+            apply_edits(message, self.engine.replace(message['text']))
             return message
 
     def _conf_settings(self, *args, **kwargs):
         return CONF_DICT
 
+    def message_types(self):
+        return CHAT_TYPES
+
     def _gui_settings(self, *args, **kwargs):
         return CONF_GUI
@@ -1,12 +1,19 @@
 # This Python file uses the following encoding: utf-8
 # -*- coding: utf-8 -*-
 # Copyright (C) 2016   CzT/Vladislav Ivanov
-import re
+import io
+import logging
 import os
+import threading
 from collections import OrderedDict
 
+from modules.helper.flush import FlushThread
+from modules.helper.matcher import RuleMatcher, to_unicode
 from modules.helper.module import MessagingModule
-from modules.helper.system import IGNORED_TYPES
+from modules.helper.system import CHAT_TYPES
+
+log = logging.getLogger('df')
+FLUSH_INTERVAL = 5
 
 CONF_DICT = OrderedDict()
 CONF_DICT['gui_information'] = {'category': 'messaging'}
@@ -36,27 +43,65 @@ class df(MessagingModule):
             with open(self.file, 'w'):
                 pass
 
+        self.lock = threading.Lock()
+        self.users = self._load_users()
+        self.writer = io.open(self.file, 'a', encoding='utf-8')
+        self.unflushed = False
+        self.roles = {}
+        self.matcher = None
+        self._build_matcher()
+        FlushThread(self, FLUSH_INTERVAL).start()
+
+    def _load_users(self):
+        with io.open(self.file, 'r', encoding='utf-8', errors='replace') as users_file:
+            return set(line.split(',')[0] for line in users_file if line.strip())
+
+    def _build_matcher(self):
+        # Profession pattern is filter symbol followed by profession regexp
+        # Config is empty when df.cfg doesn't exist
+        config = self._conf_params['config']
+        symbol = to_unicode(config.get('grep', CONF_DICT['grep'])['symbol'])
+        roles = OrderedDict()
+        for role, regexp in config.get('prof', CONF_DICT['prof']).iteritems():
+            roles.setdefault(symbol + to_unicode(regexp), to_unicode(role).capitalize())
+        self.matcher = RuleMatcher(roles.keys(), sample_interval=0, ordered=True)
+        self.roles = roles
+
+    def apply_settings(self, **kwargs):
+        MessagingModule.apply_settings(self, **kwargs)
+        self._build_matcher()
+        self.flush()
+        if kwargs.get('system_exit'):
+            with self.lock:
+                self.writer.close()
+
     def _conf_settings(self, *args, **kwargs):
         return CONF_DICT
 
+    def message_types(self):
+        return CHAT_TYPES
+
     def _gui_settings(self, *args, **kwargs):
         return CONF_GUI
 
     def write_to_file(self, user, role):
-        with open(self.file, 'r') as f:
-            for line in f.readlines():
-                if user == line.split(',')[0]:
-                    return
-        with open(self.file, 'a') as a_file:
-            a_file.write("{0},{1}\n".format(user, role))
+        user = to_unicode(user)
+        with self.lock:
+            if user in self.users or self.writer.closed:
+                return
+            self.users.add(user)
+            self.writer.write(u'{0},{1}\n'.format(user, role))
+            self.unflushed = True
+
+    def flush(self):
+        with self.lock:
+            if self.unflushed and not self.writer.closed:
+                self.writer.flush()
+                self.unflushed = False
 
     def process_message(self, message, queue, **kwargs):
         if message:
-            if message['type'] in IGNORED_TYPES:
-                return message
-            for role, regexp in self._conf_params['config']['prof'].iteritems():
-                if re.search('{0}{1}'.format(self._conf_params['config']['grep']['symbol'], regexp).decode('utf-8'),
-                             message['text']):
-                    self.write_to_file(message['user'], role.capitalize())
-                    break
+            pattern = self.matcher.search(message['text'])
+            if pattern is not None:
+                self.write_to_file(message['user'], self.roles[pattern])
             return message
@@ -1,20 +1,38 @@
 # This Python file uses the following encoding: utf-8
 # -*- coding: utf-8 -*-
 # Copyright (C) 2016   CzT/Vladislav Ivanov
+import bisect
+import itertools
+import json
 import logging
 import math
 import os
 import random
 import sqlite3
+import threading
+import time
 import xml.etree.ElementTree as ElementTree
 from collections import OrderedDict
-import datetime
 
+from modules.helper.expiry import ExpiringTimes, monotonic
+from modules.helper.flush import FlushThread
 from modules.helper.parser import save_settings
-from modules.helper.system import system_message, ModuleLoadException, IGNORED_TYPES
+from modules.helper.system import system_message, ModuleLoadException, CHAT_TYPES
 from modules.helper.module import MessagingModule
 
 log = logging.getLogger('levels')
+# Changed experience is written to db every FLUSH_INTERVAL seconds
+# or when FLUSH_COUNT users are changed
+FLUSH_INTERVAL = 5
+FLUSH_COUNT = 500
+# Experience of at most CACHE_SIZE recently seen users is kept in memory,
+# changed users stay in cache until they are written
+CACHE_SIZE = 10000
+# Stored in PRAGMA user_version, version 0 is UserLevels table without primary key,
+# version 2 adds Meta table
+SCHEMA_VERSION = 2
+# Users are read from db and remapped to new experience curve by RELEVEL_CHUNK rows
+RELEVEL_CHUNK = 50000
 
 CONF_DICT = OrderedDict()
 CONF_DICT['gui_information'] = {'category': 'messaging'}
@@ -54,16 +72,71 @@ CONF_GUI = {
     }}
 
 
+class LevelInfo(dict):
+    """
+        Level description that is shared between messages, so it can't be changed
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Level info is read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return LevelInfo, (dict(self),)
+
+
+def remap_experience(experience, old_thresholds, new_thresholds):
+    """
+        Moves experience from old level curve to new one, user keeps
+        level and progress inside level. Above the last threshold
+        experience over level start is kept as is.
+    """
+    index = bisect.bisect_left(old_thresholds, experience)
+    old_start = old_thresholds[index - 1] if index else 0
+    if index >= len(old_thresholds) or index >= len(new_thresholds):
+        index = min(index, len(new_thresholds))
+        return (new_thresholds[index - 1] if index else 0) + experience - old_start
+
+    new_start = new_thresholds[index - 1] if index else 0
+    old_size = old_thresholds[index] - old_start
+    progress = (experience - old_start) / float(old_size) if old_size > 0 else 0
+    return new_start + progress * (new_thresholds[index] - new_start)
+
+
 class levels(MessagingModule):
     @staticmethod
     def create_db(db_location):
-        if not os.path.exists(db_location):
-            db = sqlite3.connect(db_location)
-            cursor = db.cursor()
-            log.info("Creating new tables for levels")
-            cursor.execute('CREATE TABLE UserLevels (User, "Experience")')
-            cursor.close()
-            db.commit()
+        """
+            Creates db or migrates it to SCHEMA_VERSION in one transaction,
+            duplicate users of old tables are merged keeping max experience
+        """
+        db = sqlite3.connect(db_location, isolation_level=None)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            db.execute('BEGIN')
+            try:
+                table = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'UserLevels'")
+                if not table.fetchone():
+                    log.info("Creating new tables for levels")
+                    db.execute('CREATE TABLE UserLevels (User TEXT PRIMARY KEY, Experience)')
+                elif version < 1:
+                    log.info("Migrating %s to schema version %s", db_location, SCHEMA_VERSION)
+                    db.execute('ALTER TABLE UserLevels RENAME TO UserLevelsOld')
+                    db.execute('CREATE TABLE UserLevels (User TEXT PRIMARY KEY, Experience)')
+                    db.execute('INSERT INTO UserLevels (User, Experience) '
+                               'SELECT User, MAX(Experience) FROM UserLevelsOld WHERE User IS NOT NULL GROUP BY User')
+                    db.execute('DROP TABLE UserLevelsOld')
+                if version < 2:
+                    db.execute('CREATE TABLE IF NOT EXISTS Meta (Key TEXT PRIMARY KEY, Value)')
+                db.execute('PRAGMA user_version = {0}'.format(SCHEMA_VERSION))
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                db.execute('ROLLBACK')
+                raise
+        finally:
             db.close()
 
     def __init__(self, *args, **kwargs):
@@ -74,14 +147,29 @@ class levels(MessagingModule):
         self.exp_for_message = None
         self.level_file = None
         self.levels = None
+        self.thresholds = None
         self.special_levels = None
         self.db_location = None
         self.decrease_window = None
         self.threshold_users = None
 
+        self.db = None
+        self.db_lock = threading.Lock()
+        # Experience of recently seen users in LRU order, dirty users are not written to db yet
+        self.users = OrderedDict()
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.flush_thread = None
+
+        self.rest_add('POST', 'relevel', self.rest_relevel)
+        self.cli_add('relevel', self.cli_relevel)
+
     def _conf_settings(self, *args, **kwargs):
         return CONF_DICT
 
+    def message_types(self):
+        return CHAT_TYPES
+
     def _gui_settings(self, *args, **kwargs):
         return CONF_GUI
 
@@ -99,10 +187,11 @@ class levels(MessagingModule):
         self.exp_for_message = float(conf_dict['config'].get('exp_for_message'))
         self.level_file = None
         self.levels = []
+        self.thresholds = []
         self.special_levels = {}
         self.db_location = os.path.join(conf_dict['config'].get('db'))
         self.decrease_window = int(conf_dict['config'].get('decrease_window'))
-        self.threshold_users = {}
+        self.threshold_users = ExpiringTimes(self.decrease_window)
 
         # Load levels
         webchat_location = self._loaded_modules['webchat']['style_settings']['gui']['location']
@@ -112,12 +201,21 @@ class levels(MessagingModule):
             log.error("{0} not found, generating from template".format(self.level_file))
             raise ModuleLoadException("{0} not found, generating from template".format(self.level_file))
 
+        # Both dbs are migrated, so switching experience mode later doesn't need migration
+        for db_location in (self.db_location, self.db_location + '.random'):
+            if os.path.exists(db_location):
+                self.create_db(db_location)
         if self.experience == 'random':
             self.db_location += '.random'
         self.create_db(self.db_location)
+        self.db = sqlite3.connect(self.db_location, check_same_thread=False)
+        self.db.execute('PRAGMA synchronous=NORMAL')
 
         self.load_levels()
 
+        self.flush_thread = FlushThread(self, FLUSH_INTERVAL)
+        self.flush_thread.start()
+
     def load_levels(self):
         if self.levels:
             self.levels = []
@@ -144,47 +242,162 @@ class levels(MessagingModule):
                 if not level_data.attrib['url'].startswith('/'):
                     level_data.attrib['url'] = '/{}'.format(level_data.attrib['url'])
 
-                self.levels.append(level_data.attrib)
+                self.levels.append(LevelInfo(level_data.attrib))
+        self.thresholds = [level['exp'] for level in self.levels]
+        if self.db:
+            self.check_curve()
 
     def apply_settings(self, **kwargs):
         save_settings(self.conf_params(), ignored_sections=self._conf_params['gui'].get('ignored_sections', ()))
         if 'webchat' in kwargs.get('from_depend', []):
             self.load_levels()
+        if kwargs.get('system_exit') and self.db:
+            self.flush()
+            with self.db_lock:
+                self.db.close()
+                self.db = None
+
+    def get_experience(self, user):
+        """
+        :return: experience of user, None if user is new
+        """
+        with self.lock:
+            if user in self.users:
+                experience = self.users.pop(user)
+                self.users[user] = experience
+                return experience
+        with self.db_lock:
+            row = self.db.execute('SELECT Experience FROM UserLevels WHERE User = ?', [user]).fetchone()
+        return row[0] if row else None
+
+    def set_experience(self, user, experience):
+        with self.lock:
+            self.users.pop(user, None)
+            self.users[user] = experience
+            self.dirty.add(user)
+            flush = len(self.dirty) >= FLUSH_COUNT
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+            Writes changed experience to db in one transaction
+        """
+        # db_lock is taken first, so flushes are written in the order dirty users were taken
+        with self.db_lock:
+            if self.db is None:
+                return
+            with self.lock:
+                dirty, self.dirty = self.dirty, set()
+                rows = [(user, self.users[user]) for user in dirty]
+            try:
+                self._write_experience(rows)
+            except sqlite3.Error:
+                with self.lock:
+                    self.dirty.update(dirty)
+                raise
+            with self.lock:
+                self._evict()
+
+    def _evict(self):
+        """
+            Drops least recently seen users over CACHE_SIZE, only written ones
+        """
+        overflow = len(self.users) - CACHE_SIZE
+        if overflow > 0:
+            for user in [user for user in itertools.islice(self.users, overflow) if user not in self.dirty]:
+                del self.users[user]
+
+    def _write_experience(self, rows):
+        if rows:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO UserLevels (User, Experience) VALUES (?, ?)', rows)
+
+    def get_meta(self, key):
+        with self.db_lock:
+            row = self.db.execute('SELECT Value FROM Meta WHERE Key = ?', [key]).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def check_curve(self):
+        """
+            Stores current level curve, stored experience is kept
+            on previous curve until relevel is done
+        """
+        stored = self.get_meta('thresholds')
+        if stored is None:
+            with self.db_lock, self.db:
+                self.db.execute('INSERT OR REPLACE INTO Meta (Key, Value) VALUES (?, ?)',
+                                ['thresholds', json.dumps(self.thresholds)])
+        elif stored != self.thresholds:
+            log.warning("Level curve has changed, use relevel to move users to new curve")
+
+    def relevel(self):
+        """
+            Moves experience of all users from stored level curve to current one.
+            Users are read and updated by chunks in one transaction, messages
+            wait until relevel is done.
+        :return: statistics of relevel
+        """
+        start_time = time.time()
+        old_thresholds = self.get_meta('thresholds')
+        new_thresholds = list(self.thresholds)
+        users = 0
+        with self.db_lock, self.lock:
+            self._write_experience([(user, self.users[user]) for user in self.dirty])
+            self.dirty.clear()
+            if old_thresholds and old_thresholds != new_thresholds:
+                with self.db:
+                    last_row = 0
+                    while True:
+                        rows = self.db.execute('SELECT rowid, Experience FROM UserLevels WHERE rowid > ? '
+                                               'ORDER BY rowid LIMIT ?', [last_row, RELEVEL_CHUNK]).fetchall()
+                        if not rows:
+                            break
+                        self.db.executemany(
+                            'UPDATE UserLevels SET Experience = ? WHERE rowid = ?',
+                            [(remap_experience(experience, old_thresholds, new_thresholds), row_id)
+                             for row_id, experience in rows if experience is not None])
+                        users += len(rows)
+                        last_row = rows[-1][0]
+                    self.db.execute('INSERT OR REPLACE INTO Meta (Key, Value) VALUES (?, ?)',
+                                    ['thresholds', json.dumps(new_thresholds)])
+                # Cached experience is on old curve
+                self.users.clear()
+        stats = OrderedDict()
+        stats['users'] = users
+        stats['time'] = round(time.time() - start_time, 3)
+        log.info("Relevel done: %s", stats)
+        return stats
+
+    def rest_relevel(self, *args, **kwargs):
+        if self.db is None:
+            return json.dumps({'error': 'Bad Request', 'message': 'Levels db is not loaded'})
+        return json.dumps(self.relevel())
+
+    def cli_relevel(self, *args):
+        if self.db is None:
+            return 'Levels db is not loaded'
+        stats = self.relevel()
+        return 'Relevel done, {0} users moved to new curve in {1}s'.format(stats['users'], stats['time'])
 
     def set_level(self, user, queue):
         if user == 'System':
             return []
-        db = sqlite3.connect(self.db_location)
 
-        cursor = db.cursor()
-        user_select = cursor.execute('SELECT User, Experience FROM UserLevels WHERE User = ?', [user])
-        user_select = user_select.fetchall()
-
-        experience = self.exp_for_message
         exp_to_add = self.calculate_experience(user)
-        if len(user_select) == 1:
-            row = user_select[0]
-            experience = int(row[1]) + exp_to_add
-            cursor.execute('UPDATE UserLevels SET Experience = ? WHERE User = ? ', [experience, user])
-        elif len(user_select) > 1:
-            log.error("Select yielded more than one User")
-        else:
-            cursor.execute('INSERT INTO UserLevels VALUES (?, ?)', [user, experience])
-        db.commit()
+        experience = self.get_experience(user)
+        experience = self.exp_for_message if experience is None else int(experience) + exp_to_add
 
-        max_level = 0
-        for level in self.levels:
-            if level['exp'] < experience:
-                max_level += 1
+        # Number of levels with threshold below experience
+        max_level = bisect.bisect_left(self.thresholds, experience)
         if max_level >= len(self.levels):
             max_level -= 1
 
-        if experience >= self.levels[max_level]['exp']:
+        level_up = experience >= self.thresholds[max_level]
+        if level_up and (self.experience == 'random' or max_level + 1 < len(self.levels)):
             if self.experience == 'random':
                 max_level = random.randint(0, len(self.levels) - 1)
                 experience = self.levels[max_level]['exp'] - self.exp_for_level
-                cursor.execute('UPDATE UserLevels SET Experience = ? WHERE User = ? ', [experience, user])
-                db.commit()
             else:
                 max_level += 1
             system_message(
@@ -193,13 +406,11 @@ class levels(MessagingModule):
                     self.levels[max_level]['name']),
                 queue, category='module'
             )
-        cursor.close()
-        return self.levels[max_level].copy()
+        self.set_experience(user, experience)
+        return self.levels[max_level]
 
     def process_message(self, message, queue, **kwargs):
         if message:
-            if message['type'] in IGNORED_TYPES:
-                return message
             if 'system_msg' not in message or not message['system_msg']:
                 if 'user' in message and message['user'] in self.special_levels:
                     level_info = self.special_levels[message['user']]
@@ -213,8 +424,10 @@ class levels(MessagingModule):
 
     def calculate_experience(self, user):
         exp_to_add = self.exp_for_message
-        if user in self.threshold_users:
-            multiplier = (datetime.datetime.now() - self.threshold_users[user]).seconds / float(self.decrease_window)
-            exp_to_add *= multiplier if multiplier <= 1 else 1
-        self.threshold_users[user] = datetime.datetime.now()
+        now = monotonic()
+        # Users that weren't seen for decrease_window get full experience
+        last_time = self.threshold_users.swap(user, now)
+        if last_time is not None:
+            # Other shard can store a slightly later time of the same user
+            exp_to_add *= max(now - last_time, 0) / float(self.decrease_window)
         return exp_to_add
@@ -3,12 +3,30 @@
 # Copyright (C) 2016   CzT/Vladislav Ivanov
 import os
 import datetime
+import json
+import logging
+import Queue
+import threading
+import time
 from collections import OrderedDict
 
+from modules.helper.archive import ArchiveWriter, search, SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from modules.helper.logfile import LogCompressor, add_index
 from modules.helper.module import MessagingModule
-from modules.helper.system import IGNORED_TYPES, CONF_FOLDER
+from modules.helper.system import CHAT_TYPES, CONF_FOLDER
 
+log = logging.getLogger('logger')
 DEFAULT_PRIORITY = 20
+# Writer flushes file when this amount of bytes is written or FLUSH_INTERVAL seconds passed
+FLUSH_SIZE = 64 * 1024
+FLUSH_INTERVAL = 1
+STOP_TIMEOUT = 10
+ARCHIVE_FILE = 'archive.db'
+LOG_FORMATS = ['text', 'jsonl']
+LOG_EXTENSIONS = {'text': '.txt', 'jsonl': '.jsonl'}
+# Message keys that are stored in log records
+LOG_FIELDS = ('id', 'source', 'channel', 'channel_name', 'user', 'display_name', 'text', 'to',
+              'badges', 'levels', 'pm', 'mention', 'sub_message', 'bits')
 
 CONF_DICT = OrderedDict()
 CONF_DICT['gui_information'] = {
@@ -20,8 +38,157 @@ CONF_DICT['config']['logging'] = True
 CONF_DICT['config']['file_format'] = '%Y-%m-%d'
 CONF_DICT['config']['message_date_format'] = '%Y-%m-%d %H:%M:%S'
 CONF_DICT['config']['rotation'] = 'daily'
+CONF_DICT['config']['log_format'] = 'text'
+CONF_DICT['config']['compress'] = False
+CONF_DICT['config']['archive'] = False
 
-CONF_GUI = {'non_dynamic': ['config.*']}
+CONF_GUI = {
+    'non_dynamic': ['config.*'],
+    'config': {
+        'log_format': {
+            'view': 'dropdown',
+            'choices': LOG_FORMATS}}
+}
+
+
+class LogWriter(threading.Thread):
+    """
+        Writes log records in background, records are
+        (timestamp, fields) tuples, fields are taken from message (LOG_FIELDS).
+        File stays open while its name is the same, file name
+        is checked once a minute, timestamps are formatted once a second.
+        Records from shards can come slightly out of order, file is chosen by
+        the latest timestamp seen, so writer never goes back to a closed file.
+        Every minute offset of the first line is added to file index,
+        closed files are compressed in background if compress is set.
+    """
+    def __init__(self, destination, file_format, ts_format, log_format='text', compress=False,
+                 flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super(LogWriter, self).__init__()
+        self.daemon = True
+        self.queue = Queue.Queue()
+        self.destination = destination
+        self.file_format = file_format
+        self.ts_format = ts_format
+        self.log_format = log_format if log_format in LOG_EXTENSIONS else 'text'
+        self.extension = LOG_EXTENSIONS[self.log_format]
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.compressor = None
+        if compress:
+            self.compressor = LogCompressor()
+            self.compressor.start()
+
+        self.file = None
+        self.file_name = None
+        self.offset = 0
+        self.file_minute = None
+        self.last_timestamp = 0
+        self.ts_second = None
+        self.ts_text = None
+        self.unflushed = 0
+        self.flush_time = time.time()
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join(STOP_TIMEOUT)
+
+    def run(self):
+        if self.compressor:
+            self.compress_closed()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except Queue.Empty:
+                record = False
+
+            if record is None:
+                break
+            try:
+                if record:
+                    self.write(record)
+                if self.unflushed >= self.flush_size or time.time() - self.flush_time >= self.flush_interval:
+                    self.flush()
+            except Exception as exc:
+                log.exception("Unable to write log: %s", exc)
+        self.close()
+
+    def _file_name(self, timestamp):
+        return '{0}{1}'.format(os.path.join(
+            self.destination, datetime.datetime.fromtimestamp(timestamp).strftime(self.file_format)), self.extension)
+
+    def compress_closed(self):
+        """
+            Compresses log files that were left from previous runs
+        """
+        current = datetime.datetime.fromtimestamp(time.time()).strftime(self.file_format)
+        current_time = datetime.datetime.strptime(current, self.file_format)
+        for name in os.listdir(self.destination):
+            base, extension = os.path.splitext(name)
+            if extension != self.extension:
+                continue
+            try:
+                # Only files older than the current one, writer never goes back to them
+                if datetime.datetime.strptime(base, self.file_format) >= current_time:
+                    continue
+            except ValueError:
+                continue
+            self.compressor.put(os.path.join(self.destination, name))
+
+    def _get_file(self, timestamp):
+        timestamp = max(timestamp, self.last_timestamp)
+        self.last_timestamp = timestamp
+        minute = int(timestamp // 60)
+        if minute != self.file_minute:
+            self.file_minute = minute
+            file_name = self._file_name(timestamp)
+            if file_name != self.file_name:
+                closed = self.file_name
+                self.close()
+                if self.compressor and closed:
+                    self.compressor.put(closed)
+                self.file = open(file_name, 'ab', self.flush_size)
+                self.file_name = file_name
+                self.offset = os.path.getsize(file_name)
+            add_index(self.file_name, [(timestamp, self.offset)])
+        return self.file
+
+    def _format_ts(self, timestamp):
+        second = int(timestamp)
+        if second != self.ts_second:
+            self.ts_second = second
+            self.ts_text = datetime.datetime.fromtimestamp(timestamp).strftime(self.ts_format)
+        return self.ts_text
+
+    def format_record(self, timestamp, fields):
+        if self.log_format == 'jsonl':
+            fields['timestamp'] = timestamp
+            return json.dumps(fields, default=str) + '\n'
+        return u'[{3}] [{0}] {1}: {2}\n'.format(fields.get('source'), fields.get('user'), fields.get('text'),
+                                               self._format_ts(timestamp)).encode('utf-8')
+
+    def write(self, record):
+        timestamp, fields = record
+        line = self.format_record(timestamp, fields)
+        self._get_file(timestamp).write(line)
+        self.offset += len(line)
+        self.unflushed += len(line)
+
+    def flush(self):
+        if self.file and self.unflushed:
+            self.file.flush()
+        self.unflushed = 0
+        self.flush_time = time.time()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.file_name = None
+        self.unflushed = 0
 
 
 class logger(MessagingModule):
@@ -32,6 +199,10 @@ class logger(MessagingModule):
         self.ts_format = CONF_DICT['config']['message_date_format']
         self.logging = CONF_DICT['config']['logging']
         self.rotation = CONF_DICT['config']['rotation']
+        self.log_format = CONF_DICT['config']['log_format']
+        self.compress = CONF_DICT['config']['compress']
+        self.archive = None
+        self.archive_location = None
 
         self.folder = 'logs'
 
@@ -39,21 +210,63 @@ class logger(MessagingModule):
         if not os.path.exists(self.destination):
             os.makedirs(self.destination)
 
+        self.writer = LogWriter(self.destination, self.format, self.ts_format,
+                                log_format=self.log_format, compress=self.compress)
+        self.writer.start()
+
+        if CONF_DICT['config']['archive']:
+            self.archive_location = os.path.join(self.destination, ARCHIVE_FILE)
+            self.archive = ArchiveWriter(self.archive_location)
+            self.archive.start()
+        self.rest_add('GET', 'search', self.rest_search)
+
     def _conf_settings(self, *args, **kwargs):
         return CONF_DICT
 
+    def message_types(self):
+        return CHAT_TYPES
+
     def _gui_settings(self, *args, **kwargs):
         return CONF_GUI
 
     def process_message(self, message, queue, **kwargs):
         if message:
-            if message['type'] in IGNORED_TYPES:
-                return message
-            with open('{0}.txt'.format(
-                    os.path.join(self.destination, datetime.datetime.now().strftime(self.format))), 'a') as f:
-                f.write('[{3}] [{0}] {1}: {2}\n'.format(
-                    message['source'].encode('utf-8'),
-                    message['user'].encode('utf-8'),
-                    message['text'].encode('utf-8'),
-                    datetime.datetime.now().strftime(self.ts_format).encode('utf-8')))
+            self.process_batch([message], queue)
             return message
+
+    def process_batch(self, messages, queue, **kwargs):
+        timestamp = time.time()
+        for message in messages:
+            # Fields are copied here, message can be changed by other modules after logger
+            record = (timestamp, dict((key, message[key]) for key in LOG_FIELDS if key in message))
+            self.writer.put(record)
+            if self.archive:
+                self.archive.put(record)
+        return messages
+
+    def rest_search(self, *args, **kwargs):
+        """
+            Searches message archive, parameters: user, text, source,
+            from/to (unix timestamps), limit, before (id of the last message of previous page)
+        """
+        if not self.archive:
+            return json.dumps({'error': 'Bad Request', 'message': 'Archive is disabled'})
+        try:
+            limit = max(1, min(int(kwargs.get('limit', SEARCH_LIMIT)), MAX_SEARCH_LIMIT))
+            start = float(kwargs['from']) if kwargs.get('from') else None
+            end = float(kwargs['to']) if kwargs.get('to') else None
+            before = int(kwargs['before']) if kwargs.get('before') else None
+        except ValueError as exc:
+            return json.dumps({'error': 'Bad Request', 'message': str(exc)})
+
+        messages = search(self.archive_location, user=kwargs.get('user'), text=kwargs.get('text'),
+                          source=kwargs.get('source'), start=start, end=end, before=before, limit=limit)
+        return json.dumps({'messages': messages,
+                           'next': messages[-1]['id'] if messages and len(messages) == limit else None})
+
+    def apply_settings(self, **kwargs):
+        MessagingModule.apply_settings(self, **kwargs)
+        if kwargs.get('system_exit'):
+            self.writer.stop()
+            if self.archive:
+                self.archive.stop()
@@ -1,11 +1,14 @@
 # This Python file uses the following encoding: utf-8
 # -*- coding: utf-8 -*-
 # Copyright (C) 2016   CzT/Vladislav Ivanov
+import json
 import re
+import threading
 from collections import OrderedDict
 
+from modules.helper.matcher import RuleMatcher
 from modules.helper.module import MessagingModule
-from modules.helper.system import IGNORED_TYPES
+from modules.helper.system import CHAT_TYPES
 
 CONF_DICT = OrderedDict()
 CONF_DICT['gui_information'] = {'category': 'messaging'}
@@ -25,11 +28,53 @@ CONF_GUI = {
 class mentions(MessagingModule):
     def __init__(self, *args, **kwargs):
         MessagingModule.__init__(self, *args, **kwargs)
-        # Creating filter and replace strings.
+        self.mentions = None
+        self.address = None
+        self.messages = 0
+        self.stats_lock = threading.Lock()
+        self._build_matchers()
+
+        self.rest_add('GET', 'stats', self.rest_get_stats)
+        self.rest_add('DELETE', 'stats', self.rest_reset_stats)
+
+    def _build_matchers(self):
+        # Config is empty when mentions.cfg doesn't exist
+        config = self._conf_params['config']
+        mentions_matcher = RuleMatcher(config.get('mentions', CONF_DICT['mentions']), flags=re.IGNORECASE)
+        mentions_matcher.inherit_stats(self.mentions)
+        address_matcher = RuleMatcher(config.get('address', CONF_DICT['address']), flags=re.IGNORECASE,
+                                      anchored=True)
+        address_matcher.inherit_stats(self.address)
+        self.mentions = mentions_matcher
+        self.address = address_matcher
+
+    def apply_settings(self, **kwargs):
+        MessagingModule.apply_settings(self, **kwargs)
+        self._build_matchers()
+
+    def get_stats(self):
+        stats = OrderedDict()
+        stats['messages'] = self.messages
+        stats['mentions'] = self.mentions.get_stats()
+        stats['address'] = self.address.get_stats()
+        return stats
+
+    def rest_get_stats(self, *args, **kwargs):
+        return json.dumps(self.get_stats())
+
+    def rest_reset_stats(self, *args, **kwargs):
+        self.mentions.reset_stats()
+        self.address.reset_stats()
+        with self.stats_lock:
+            self.messages = 0
+        return json.dumps(self.get_stats())
 
     def _conf_settings(self, *args, **kwargs):
         return CONF_DICT
 
+    def message_types(self):
+        return CHAT_TYPES
+
     def _gui_settings(self, *args, **kwargs):
         return CONF_GUI
 
@@ -37,18 +82,14 @@ class mentions(MessagingModule):
         # Replacing the message if needed.
         # Please do the needful
         if message:
-            if message['type'] in IGNORED_TYPES:
-                return message
-
-            for mention in self._conf_params['config']['mentions']:
-                if re.search(mention, message['text'].lower()):
-                    message['mention'] = True
-                    break
-
-            for address in self._conf_params['config']['address']:
-                if re.match(address, message['text'].lower()):
-                    message['pm'] = True
-                    break
+            with self.stats_lock:
+                self.messages += 1
+            text = message['text'].lower()
+            if self.mentions.search(text) is not None:
+                message['mention'] = True
+
+            if self.address.search(text) is not None:
+                message['pm'] = True
 
             if 'mention' in message and 'pm' in message:
                 message.pop('mention')
@@ -7,7 +7,6 @@ import socket
 import cherrypy
 import logging
 import datetime
-import copy
 from scss import Compiler
 from scss.namespace import Namespace
 from scss.types import Color, Boolean, String, Number
@@ -48,9 +47,12 @@ CONF_DICT['style_settings']['show_system_msg'] = True
 
 
 def prepare_message(msg, style_settings):
-    message = copy.deepcopy(msg)
+    # Only top level keys and levels are changed, so there is
+    #  no need to copy the whole message
+    message = dict(msg)
 
     if 'levels' in message:
+        message['levels'] = dict(message['levels'])
         message['levels']['url'] = '{}?{}'.format(message['levels']['url'], style_settings['style_name'])
 
     if 'text' in message and message['text'] == REMOVED_TRIGGER:
@@ -272,6 +274,24 @@ class WebChatPlugin(WebSocketPlugin):
                         del self.history[index]['bttv_emotes']
 
 
+NDJSON_TYPES = ['application/x-ndjson', 'application/ndjson', 'application/jsonl']
+
+
+def load_rest_body(body, content_type=None):
+    """
+        Loads JSON request body, NDJSON (JSON value per line) is loaded as list,
+        body with NDJSON content type is always a list, even with one line
+    """
+    if not body.strip():
+        return None
+    if content_type and content_type.split(';')[0].strip().lower() in NDJSON_TYPES:
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    try:
+        return json.loads(body)
+    except ValueError:
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
 class RestRoot(object):
     def __init__(self, settings, modules):
         self.settings = settings
@@ -292,8 +312,12 @@ class RestRoot(object):
 
         body = cherrypy.request.body
         if cherrypy.request.method in cherrypy.request.methods_with_bodies:
-            data = json.load(body)
-            kwargs.update(data)
+            data = load_rest_body(body.read(), cherrypy.request.headers.get('Content-Type'))
+            # Arrays and NDJSON are passed as data, objects are passed as keyword arguments
+            if isinstance(data, dict):
+                kwargs.update(data)
+            elif data is not None:
+                kwargs['data'] = data
 
         if len(args) > 1:
             module_name = args[0]
@@ -593,7 +617,7 @@ class webchat(MessagingModule):
 
     @staticmethod
     def rest_get_history(*args, **kwargs):
-        return json.dumps(cherrypy.engine.publish('get-history')[0])
+        return json.dumps([dict(message) for message in cherrypy.engine.publish('get-history')[0]])
 
     @staticmethod
     def rest_delete_history(path, **kwargs):
@@ -0,0 +1,98 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import argparse
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import messaging
+from modules.helper.replay import Replayer
+from modules.helper.system import load_translations_keys, get_language, PYTHON_FOLDER, CONF_FOLDER, \
+    TRANSLATION_FOLDER, LOG_FORMAT, THREADS, BATCH_SIZE, BATCH_TIMEOUT, QUEUE_SIZE, ModuleLoadException
+
+log = logging.getLogger('replay')
+
+
+def load_pipeline(workers=THREADS, batch_size=BATCH_SIZE, batch_timeout=BATCH_TIMEOUT):
+    """
+        Loads messaging modules the same way main does, without chats and GUI
+    :return: (queue, Message, loaded modules)
+    """
+    main_config = {'root_folder': PYTHON_FOLDER,
+                   'conf_folder': CONF_FOLDER}
+    settings = {'config': {'system': {'workers': workers,
+                                      'batch_size': batch_size,
+                                      'batch_timeout': batch_timeout,
+                                      'stats_interval': 0}}}
+    try:
+        load_translations_keys(TRANSLATION_FOLDER, get_language())
+    except Exception as exc:
+        log.debug("Exception: %s", exc)
+        log.exception("Failed loading translations")
+
+    # Replaying should not lose messages, so producer is blocked instead
+    queue = messaging.MessageQueue(maxsize=QUEUE_SIZE, policy=messaging.POLICY_BLOCK)
+    msg = messaging.Message(queue)
+
+    loaded_modules = OrderedDict()
+    loaded_modules['main'] = settings
+    loaded_modules.update(msg.load_modules(main_config, settings))
+    for f_module, f_config in loaded_modules.items():
+        if 'class' in f_config:
+            try:
+                f_config['class'].load_module(main_settings=main_config, loaded_modules=loaded_modules,
+                                              queue=queue)
+            except ModuleLoadException:
+                msg.remove_module(f_config['class'])
+                loaded_modules.pop(f_module)
+    return queue, msg, loaded_modules
+
+
+def close_pipeline(loaded_modules):
+    for f_config in loaded_modules.values():
+        if 'class' in f_config:
+            f_config['class'].apply_settings(system_exit=True)
+
+
+def report(count, elapsed, msg):
+    result = OrderedDict()
+    result['messages'] = count
+    result['seconds'] = round(elapsed, 3)
+    result['messages_per_second'] = round(count / elapsed, 1) if elapsed else 0
+    result['stats'] = msg.get_stats()
+    return json.dumps(result, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays recorded messages through messaging modules')
+    parser.add_argument('file', help='recording made with system.record_file setting')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='multiplier of recorded pace, 0 replays as fast as possible')
+    parser.add_argument('--workers', type=int, default=THREADS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--batch-timeout', type=int, default=BATCH_TIMEOUT, help='milliseconds')
+    args = parser.parse_args()
+
+    queue, msg, loaded_modules = load_pipeline(args.workers, args.batch_size, args.batch_timeout)
+    msg.start()
+
+    log.info("Replaying %s", args.file)
+    start_time = time.time()
+    count = Replayer(args.file, queue, speed=args.speed).run()
+    msg.wait_processed()
+    elapsed = time.time() - start_time
+
+    print report(count, elapsed, msg)
+    close_pipeline(loaded_modules)
+    # Message handlers are not daemon threads
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(LOG_FORMAT)
+    root_logger.addHandler(console_handler)
+    main()
@@ -0,0 +1,54 @@
+# Copyright (C) 2016   CzT/Vladislav Ivanov
+import os
+import shutil
+import tempfile
+import unittest
+
+from modules.messaging.blacklist import blacklist
+from modules.messaging.c2b import c2b
+from modules.messaging.df import df
+from modules.messaging.mentions import mentions
+
+
+def chat_message(text):
+    return {'type': 'message', 'source': 'tw', 'user': 'user', 'text': text}
+
+
+class MissingConfigTest(unittest.TestCase):
+    """
+        Modules are loaded without their config file, default settings are used
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def conf_file(self, module_name):
+        return os.path.join(self.folder, '{0}.cfg'.format(module_name))
+
+    def test_blacklist(self):
+        module = blacklist(conf_file_name=self.conf_file('blacklist'))
+        self.assertEqual(module.process_message(chat_message(u'text'), None)['text'], u'text')
+
+    def test_c2b(self):
+        module = c2b(conf_file_name=self.conf_file('c2b'))
+        self.assertEqual(module.process_message(chat_message(u'text'), None)['text'], u'text')
+
+    def test_df(self):
+        # df keeps users file relative to working directory
+        cwd = os.getcwd()
+        os.chdir(self.folder)
+        try:
+            module = df(conf_file_name=self.conf_file('df'))
+            self.assertEqual(module.process_message(chat_message(u'#text'), None)['text'], u'#text')
+        finally:
+            os.chdir(cwd)
+
+    def test_mentions(self):
+        module = mentions(conf_file_name=self.conf_file('mentions'))
+        self.assertNotIn('mention', module.process_message(chat_message(u'text'), None))
+
+
+if __name__ == '__main__':
+    unittest.main()